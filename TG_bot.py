@@ -1,238 +1,129 @@
-import telebot
-from telebot import types
-
+import argparse
 
+import metrics_config
+import quiz_config as quiz
 from psql_config import *
+from send_config import enqueue, start_sender, outbox_stats
+from YAD_config import translation_cache_stats
+from log_config import log_stats
+from prefetch_config import prefetch_stats
 from common_config import load_data_from_file
+from dispatch_config import ShardedTeleBot
+from migrate_config import pending_migrations
 
 """
 Модуль реализует Telegram-бота для изучения английского языка путем запоминания слов и проверки знаний пользователя.
+Бизнес-логика вынесена в quiz_config и общая с асинхронным режимом (TG_bot_async.py).
 
 Основные функции:
+- send_replies(cid, replies): Ставит ответы, сформированные бизнес-логикой, в очередь отправки.
 - handle_start(message): Обрабатывает команду '/start'.
-- process_name_input(message): Обрабатывает ввод имени пользователя после старта.
-- ask_question(cid): Запрашивает у пользователя перевод случайного слова.
-- show_menu(cid): Показывает меню с выбором вариантов перевода слова.
-- handle_response(message): Обрабатывает ответ пользователя на задание перевода.
-- increment_count(cid, target_word): Увеличивает счетчик правильных ответов на перевод слова.
-- handle_add_word(message): Обрабатывает событие добавления слова в словарь.
-- process_add_word(message): Обрабатывает факт добавления слова.
-- handle_del_word(message): Обрабатывает событие удаления слова из словаря.
-- process_del_word(message): Обрабатывает факт удаления слова.
+- handle_import(message): Обрабатывает команду '/import' (массовый импорт слов).
+- handle_stats(message): Обрабатывает команду '/stats' (статистика пользователя).
+- handle_document(message): Импортирует слова из присланного файла .txt/.csv.
+- handle_text(message): Передаёт ввод ожидающему шагу, обрабатывает кнопки "Добавить слово", "Удалить слово", "Дальше"
+  и ответ пользователя на задание перевода.
+- handle_callback(call): Обрабатывает нажатие inline-кнопки (режим quiz_config.QUIZ_KEYBOARD = 'inline').
+
+Обновления обрабатываются потоками-шардами dispatch_config: сообщения одного чата - строго по очереди.
+
+Запуск: `python TG_bot.py` (long polling) или `python TG_bot.py --webhook [--url https://...]` (webhook, см. webhook_config).
 
 Обработчики:
 - @bot.message_handler(commands=['start']): Начальная точка входа для пользователя.
-- @bot.message_handler(func=lambda message: message.text.strip() != "Добавить слово \"+\"" and message.text.strip() != "Удалить слово \"-\"" and message.text.strip() != "Дальше ⏭"): Основная логика работы с ответами пользователя.
-- @bot.message_handler(func=lambda message: message.text.startswith("Добавить")): Обработчик добавления слова.
-- @bot.message_handler(func=lambda message: message.text.startswith("Удалить")): Обработчик удаления слова.
-- @bot.message_handler(func=lambda message: message.text.startswith("Дальше")): Обработчик перехода к следующему вопросу.
+- @bot.message_handler(commands=['import']): Массовый импорт слов списком или файлом.
+- @bot.message_handler(commands=['stats']): Статистика занятий пользователя.
+- @bot.message_handler(content_types=['document']): Файл со словами для импорта.
+- @bot.message_handler(content_types=['text']): Ввод, которого ждёт бот, кнопки клавиатуры и ответы пользователя.
+- @bot.callback_query_handler(func=lambda call: True): Ответы и служебные кнопки inline-клавиатуры.
 """
 
-# Работа бота начинается с единоразового выполнения функций:
-# - по созданию БД (create_tables(engine)
-# - наполнению БД тестовыми данными insert_data(russian_words)
+# Работа бота начинается с единоразового выполнения:
+# - создания и обновления схемы БД (python migrate_config.py upgrade)
+# - наполнения БД тестовыми данными insert_data(russian_words)
 
 token_TG = load_data_from_file('token_TG.txt')
-bot = telebot.TeleBot(token_TG)
-
-current_question = {}
-
-@bot.message_handler(commands=['start'])
-def handle_start(message):
-    cid = message.chat.id
-
-    # Проверяем, существует ли пользователь
-    existing_user = session.query(Users).filter_by(telegram_id=cid).first()
-
-    if not existing_user:
-        # Если пользователя нет, просим ввести имя
-        msg = bot.send_message(cid, "Привет 👋\n\nДавай попрактикуемся в английском языке\\!\n\n"
-                              "Тренировки можешь проходить в удобном для себя темпе\\.\n\n"
-                              "У тебя есть возможность использовать тренажёр, как конструктор\\, так и собирать свою собственную базу для обучения\\.\n\n"
-                              "\\*Для этого воспользуйся инструментами:\\* \n"
-                              "\\- добавить слово ➕\n"
-                              "\\- удалить слово ❌\\.\n\n"
-                              "Ну что, начнём\\? Как тебя зовут\\? ", parse_mode="MarkdownV2")
-        bot.register_next_step_handler(msg, process_name_input)
-    else:
-        # Если пользователь известен, приветствуем его по имени
-        greeting_message = f"Hello, {existing_user.name.title()}, let's continue learning English..."
-        bot.send_message(cid, greeting_message)
-
-        # Начинаем обучение с первого вопроса
-        ask_question(cid)
-
-def process_name_input(message):
-    cid = message.chat.id
-    user_name = message.text.strip()
-
-    # Регистрируем пользователя с введённым именем
-    add_user(cid, user_name=user_name.title())
-
-    # Приветствуем пользователя по имени
-    greeting_message = f"Nice to meet you, {user_name.title()}! Let's start learning English..."
-    bot.send_message(cid, greeting_message)
-
-    # Начинаем обучение с первого вопроса
-    ask_question(cid)
-
-def ask_question(cid):
-    # Получаем случайное целевое слово
-    target_word = random_target_word(cid)
-    translated_word = translate_target_word(target_word).title()
-
-    # Сохраняем текущее слово в состоянии
-    current_question[cid] = {'target_word': target_word, 'translated_word': translated_word}
-
-    # Генерация интерфейса с кнопками
-    show_menu(cid)
-
-def show_menu(cid):
-    markup = types.ReplyKeyboardMarkup(row_width=2)
-
-    # Берем текущее слово из памяти
-    target_word = current_question[cid]['target_word']
-    translated_word = current_question[cid]['translated_word']
-
-    # Кнопка правильного перевода
-    target_word_btn = types.KeyboardButton(translated_word)
-
-    # Другие возможные переводы
-    others = other_words()
-    other_words_btns = [types.KeyboardButton(word.title()) for word in others]
-
-    # Объединяем кнопки и перемешиваем их
-    buttons = [target_word_btn] + other_words_btns
-    random.shuffle(buttons)
-
-    # Стандартные кнопки "/add_word" и "/del_word"
-    add_word_btn = types.KeyboardButton('Добавить слово "+" ')
-    del_word_btn = types.KeyboardButton('Удалить слово "-" ')
-    next_btn = types.KeyboardButton('Дальше ⏭')
-    buttons.extend([add_word_btn, del_word_btn, next_btn])
-
-    # Добавляем кнопки построчно
-    for i in range(0, len(buttons), 2):
-        row_buttons = buttons[i:i+2]
-        markup.row(*row_buttons)
+bot = ShardedTeleBot(token_TG)
 
-    greeting = f"Выбери перевод слова:\n🇷🇺 {target_word.title()}"
-    bot.send_message(cid, greeting, reply_markup=markup)
+# Ответы отправляются потоками send_config с учётом лимитов Telegram, обработчик их не ждёт
+start_sender(bot)
 
+def send_replies(cid, replies):
+    enqueue(cid, replies)
 
-@bot.message_handler(func=lambda message: message.text.strip() != "Добавить слово \"+\"" and
-                                        message.text.strip() != "Удалить слово \"-\"" and
-                                        message.text.strip() != "Дальше ⏭")
+# Прогресс длительных операций (импорта) идёт через ту же очередь отправки
+quiz.set_notifier(send_replies)
 
-
-def handle_response(message):
+@bot.message_handler(commands=['start'])
+def handle_start(message):
     cid = message.chat.id
+    send_replies(cid, quiz.start(cid))
 
-    # Получаем текущее слово и перевод из состояния
-    target_word = current_question.get(cid, {}).get('target_word')
-    correct_translation = current_question.get(cid, {}).get('translated_word')
-
-    # Проверяем, совпадают ли нажатая кнопка с правильным переводом
-    if message.text.strip().lower() == correct_translation.lower():
-        # Ответ правильный!
-        increment_count(cid, target_word)
-        bot.send_message(cid, "🎉 Правильно! Переходим к следующему слову.")
-        # Очистка данных после правильного ответа
-        del current_question[cid]
-        ask_question(cid)  # Переход к следующему вопросу
-    elif message.text.strip().lower() != correct_translation:
-        # Неправильный ответ
-        bot.send_message(cid, "❗ Ошибка! Попробуйте еще раз.")
-        # Ничего не делаем, оставляем прежний вопрос
-    else:
-        bot.send_message(cid, "Ой, похоже что-то пошло не так... Попробуем начать сначала.")
-        ask_question(cid)
-        return
-
-# Функция для увеличения счетчика правильных ответов на перевод слова
-def increment_count(cid, target_word):
-    with session.no_autoflush:
-        # Получаем пользователя
-        user = session.query(Users).filter_by(telegram_id=str(cid)).first()
-
-        # Получаем слово
-        word_obj = session.query(Words).filter_by(russian_word=target_word).first()
-
-        # Получаем связь пользователя и слова
-        user_word_link = session.query(UserWords).filter_by(user_id=user.id, word_id=word_obj.id).first()
-
-        # Увеличиваем счетчик
-        user_word_link.count += 1
-        session.commit()
-
-# Обработчик события на кнопку "Добавить слово"
-@bot.message_handler(func=lambda message: message.text.startswith("Добавить"))
-
-def handle_add_word(message):
+@bot.message_handler(commands=['import'])
+def handle_import(message):
     cid = message.chat.id
+    send_replies(cid, quiz.handle_import(cid))
 
-    # Запрашиваем у пользователя слово для добавления
-    msg = bot.send_message(cid, "Введите русское слово, которое хотите добавить в словарь:")
-    bot.register_next_step_handler(msg, process_add_word)
-
-def process_add_word(message):
+@bot.message_handler(commands=['stats'])
+def handle_stats(message):
     cid = message.chat.id
-    word = message.text.strip()
-
-    success, translated_word = add_word(cid, word)
+    send_replies(cid, quiz.handle_stats(cid))
 
-    if success:
-        # Получили успешный результат и перевод
-        num_words = get_user_word_count(cid)
-        bot.send_message(cid, f"Слово '{word.title()} / {translated_word.title()}' успешно добавлено. Всего слов в вашем словаре: {num_words}")
-    elif translated_word is not None:
-        # Случай, когда слово уже есть в словаре
-        bot.send_message(cid,f"Слово '{word.title()} / {translated_word.title()}' уже есть в вашем словаре.")
-    else:
-        # Ошибка перевода или другое условие неудачи
-        bot.send_message(cid, f"Перевод слова '{word.title()}' не найден. Добавить такое слово не получится.")
-
-    return ask_question(cid)
-
-# Обработчик события на кнопку "Удалить слово"
-@bot.message_handler(func=lambda message: message.text.startswith("Удалить"))
-def handle_del_word(message):
-    cid = message.chat.id
-
-    # Запрашиваем у пользователя слово для удаления
-    msg = bot.send_message(cid, "Введите русское слово, которое хотите удалить из словаря:")
-    bot.register_next_step_handler(msg, process_del_word)
-
-def process_del_word(message):
+# Файл со списком слов для импорта
+@bot.message_handler(content_types=['document'])
+def handle_document(message):
     cid = message.chat.id
-    word = message.text.strip()
-    existing_word = session.query(Words).filter_by(russian_word=word.lower()).first()
-    translated_word = translate(word)
-    if not existing_word:
-        bot.send_message(cid, f"Cлова '{word.title()}' нет в Вашем словаре")
-
-        return ask_question(cid)
-
-    # Удаляем слово
-    success = del_word(cid, word)
-
-    if success:
-        # Узнаем количество слов у пользователя
-        num_words = get_user_word_count(cid)
-        bot.send_message(cid, f"Слово '{word.title()} / {translated_word.title()}' успешно удалено. Всего слов в Вашем словаре: {num_words}")
-    else:
-        bot.send_message(cid, f"Слова '{word.title()} / {existing_word.english_word.title()}' не было в Вашем словаре.")
-
-    return ask_question(cid)
-
-# Обработчик события на кнопку "Дальше"
-@bot.message_handler(func=lambda message: message.text.startswith("Дальше"))
-def handle_del_word(message):
+    document = message.document
+    replies = quiz.check_document(document.file_name, document.file_size)
+    if not replies:
+        data = bot.download_file(bot.get_file(document.file_id).file_path)
+        replies = quiz.process_document(cid, document.file_name, data)
+    send_replies(cid, replies)
+
+# Остальные текстовые сообщения: ввод, которого ждёт бот, нажатие кнопки (поиск в словаре quiz.BUTTONS
+# вместо проверки фильтра каждого обработчика) или ответ на задание перевода
+@bot.message_handler(content_types=['text'])
+def handle_text(message):
     cid = message.chat.id
+    send_replies(cid, quiz.handle_text(cid, message.text))
 
-    # Начинаем обучение с первого вопроса
-    ask_question(cid)
+# Нажатие inline-кнопки: ответ редактирует сообщение, под которым была кнопка
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    cid = call.message.chat.id
+    send_replies(cid, quiz.handle_callback(cid, call.message.message_id, call.data))
+    # Ответ ставится в очередь до подтверждения нажатия, чтобы подтверждение не задерживало правку сообщения
+    bot.answer_callback_query(call.id)
 
 if __name__ == '__main__':
-    print('Bot is running...')
-    bot.polling()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Telegram-бот ImLearningEnglish')
+    parser.add_argument('--webhook', action='store_true', help='принимать обновления через webhook вместо polling')
+    parser.add_argument('--url', help='публичный адрес бота для регистрации webhook в Telegram')
+    parser.add_argument('--host', default='0.0.0.0', help='адрес встроенного HTTP-сервера')
+    parser.add_argument('--port', type=int, default=8443, help='порт встроенного HTTP-сервера')
+    args = parser.parse_args()
+
+    # Схема БД без индексов и ограничений из migrate_config работает, но медленно
+    if pending_migrations():
+        print('Внимание: схема БД устарела, выполните `python migrate_config.py upgrade`')
+    # Загружаем общий словарь в кэш до приёма первых сообщений (пулы вариантов ответа рассчитываются в фоне)
+    refresh_vocabulary(force=True)
+
+    metrics_config.register_gauges('translation_cache', translation_cache_stats)
+    metrics_config.register_gauges('outbox', outbox_stats)
+    metrics_config.register_gauges('log', log_stats)
+    metrics_config.register_gauges('prefetch', prefetch_stats)
+    metrics_config.register_gauges('dispatch', bot.dispatch_stats)
+    metrics_config.start_metrics_server()
+
+    if args.webhook:
+        from webhook_config import run_webhook, webhook_stats
+
+        metrics_config.register_gauges('webhook', webhook_stats)
+
+        print('Bot is running (webhook)...')
+        run_webhook(bot, load_data_from_file('webhook_secret.txt').strip(), host=args.host, port=args.port,
+                    url=args.url)
+    else:
+        print('Bot is running...')
+        bot.polling()
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+import metrics_config
+import quiz_config as quiz
+from psql_config import refresh_vocabulary
+from send_config import (coalesce, TokenBucket, GLOBAL_RATE, GLOBAL_BURST, PER_CHAT_RATE, PER_CHAT_BURST,
+                         MAX_TRACKED_CHATS)
+from YAD_config import translation_cache_stats
+from log_config import log_stats
+from prefetch_config import prefetch_stats
+from common_config import load_data_from_file
+from dispatch_config import update_chat_id
+from migrate_config import pending_migrations
+
+"""
+Асинхронный режим бота на AsyncTeleBot: один процесс обслуживает множество чатов в одном цикле событий.
+Обработчики те же, что и в TG_bot.py, и используют ту же бизнес-логику из quiz_config.
+Блокирующие обращения к БД и Yandex.Dictionary выполняются в ограниченном пуле потоков,
+поэтому ожидание ответа Telegram API не занимает поток. Обновления разных чатов обрабатываются
+параллельно, а обновления одного чата - по очереди (ChatOrderedAsyncTeleBot).
+
+Основные функции:
+- ChatOrderedAsyncTeleBot: AsyncTeleBot, который не обрабатывает одновременно два обновления одного чата.
+- run_logic(func, *args): Выполняет функцию бизнес-логики в пуле потоков.
+- send_replies(cid, replies): Асинхронно отправляет пользователю сформированные ответы (по очереди для каждого чата)
+  с теми же лимитами частоты, что и send_config, и повтором после ответа 429.
+- send_stats(): Возвращает счётчики отправки.
+- main(): Запускает бота в асинхронном режиме.
+"""
+
+# Количество потоков для блокирующих вызовов бизнес-логики
+LOGIC_WORKERS = 32
+
+# Очередь обновлений каждого чата: asyncio.Lock пропускает ожидающих в порядке прихода
+_update_locks = weakref.WeakValueDictionary()
+
+class ChatOrderedAsyncTeleBot(AsyncTeleBot):
+    async def process_new_updates(self, updates):
+        await asyncio.gather(*(self._process_in_order(update) for update in updates))
+
+    async def _process_in_order(self, update):
+        cid = update_chat_id(update)
+        lock = _update_locks.get(cid)
+        if lock is None:
+            lock = _update_locks[cid] = asyncio.Lock()
+
+        async with lock:
+            await super().process_new_updates([update])
+
+token_TG = load_data_from_file('token_TG.txt')
+bot = ChatOrderedAsyncTeleBot(token_TG)
+
+executor = ThreadPoolExecutor(max_workers=LOGIC_WORKERS, thread_name_prefix='logic')
+
+async def run_logic(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+# Ответы одному чату отправляются по очереди: правка по tag должна идти после отправки помеченного сообщения
+_chat_locks = weakref.WeakValueDictionary()
+# (cid, tag) -> id отправленного сообщения
+_tagged = OrderedDict()
+MAX_TAGGED = 10000
+
+# Лимиты частоты те же, что у очереди отправки синхронного режима (send_config). Все корутины работают
+# в одном цикле событий, поэтому корзинам токенов блокировка не нужна
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+_chat_buckets = OrderedDict()
+
+stats = {
+    'sent': 0,
+    'coalesced': 0,
+    'retried': 0,
+    'failed': 0,
+}
+
+def send_stats():
+    return dict(stats)
+
+# Ждём токен корзины чата и общей корзины бота
+async def _wait_for_rate_limit(cid):
+    bucket = _chat_buckets.get(cid)
+    if bucket is None:
+        bucket = _chat_buckets[cid] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+        while len(_chat_buckets) > MAX_TRACKED_CHATS:
+            _chat_buckets.popitem(last=False)
+    _chat_buckets.move_to_end(cid)
+
+    for limit in (bucket, _global_bucket):
+        delay = limit.take()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = limit.take()
+
+async def _deliver(cid, item):
+    message_id = item.get('message_id')
+    if isinstance(message_id, str):
+        message_id = _tagged.get((cid, message_id))
+
+    if message_id:
+        # Ответ на нажатие inline-кнопки или ход импорта редактирует уже отправленное сообщение
+        await bot.edit_message_text(item['text'], cid, message_id, reply_markup=item['reply_markup'],
+                                    parse_mode=item['parse_mode'])
+        return
+
+    sent = await bot.send_message(cid, item['text'], reply_markup=item['reply_markup'],
+                                  parse_mode=item['parse_mode'])
+    if item.get('tag'):
+        _tagged[(cid, item['tag'])] = sent.message_id
+        while len(_tagged) > MAX_TAGGED:
+            _tagged.popitem(last=False)
+
+async def send_replies(cid, replies):
+    lock = _chat_locks.get(cid)
+    if lock is None:
+        lock = _chat_locks[cid] = asyncio.Lock()
+
+    async with lock:
+        # Подряд идущие ответы (например, "Правильно!" и следующий вопрос) отправляем одним сообщением
+        messages = coalesce(replies)
+        stats['coalesced'] += len(replies) - len(messages)
+
+        for item in messages:
+            method = 'telegram_edit_message' if item.get('message_id') else 'telegram_send_message'
+            while True:
+                await _wait_for_rate_limit(cid)
+                started = time.perf_counter()
+                try:
+                    await _deliver(cid, item)
+                except ApiTelegramException as e:
+                    if metrics_config.METRICS_ENABLED:
+                        metrics_config.observe('external', method, time.perf_counter() - started, True)
+                    if e.error_code == 429:
+                        # Telegram просит подождать: остальные ответы чата ждут вместе с этим (блокировка чата)
+                        retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                        stats['retried'] += 1
+                        await asyncio.sleep(retry_after)
+                        continue
+                    if 'message is not modified' in str(e.description):
+                        # Повторное нажатие той же кнопки: сообщение уже в нужном виде
+                        stats['sent'] += 1
+                    else:
+                        stats['failed'] += 1
+                        print(f'Ошибка {e}')
+                    break
+                except Exception as e:
+                    if metrics_config.METRICS_ENABLED:
+                        metrics_config.observe('external', method, time.perf_counter() - started, True)
+                    stats['failed'] += 1
+                    print(f'Ошибка {e}')
+                    break
+
+                if metrics_config.METRICS_ENABLED:
+                    metrics_config.observe('external', method, time.perf_counter() - started)
+                stats['sent'] += 1
+                break
+
+@bot.message_handler(commands=['start'])
+async def handle_start(message):
+    cid = message.chat.id
+    await send_replies(cid, await run_logic(quiz.start, cid))
+
+@bot.message_handler(commands=['import'])
+async def handle_import(message):
+    cid = message.chat.id
+    await send_replies(cid, await run_logic(quiz.handle_import, cid))
+
+@bot.message_handler(commands=['stats'])
+async def handle_stats(message):
+    cid = message.chat.id
+    await send_replies(cid, await run_logic(quiz.handle_stats, cid))
+
+# Файл со списком слов для импорта
+@bot.message_handler(content_types=['document'])
+async def handle_document(message):
+    cid = message.chat.id
+    document = message.document
+    replies = quiz.check_document(document.file_name, document.file_size)
+    if not replies:
+        file_info = await bot.get_file(document.file_id)
+        data = await bot.download_file(file_info.file_path)
+        replies = await run_logic(quiz.process_document, cid, document.file_name, data)
+    await send_replies(cid, replies)
+
+# Остальные текстовые сообщения: ввод, которого ждёт бот, нажатие кнопки (поиск в словаре quiz.BUTTONS
+# вместо проверки фильтра каждого обработчика) или ответ на задание перевода
+@bot.message_handler(content_types=['text'])
+async def handle_text(message):
+    cid = message.chat.id
+    await send_replies(cid, await run_logic(quiz.handle_text, cid, message.text))
+
+# Нажатие inline-кнопки: ответ редактирует сообщение, под которым была кнопка
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    cid = call.message.chat.id
+    replies = await run_logic(quiz.handle_callback, cid, call.message.message_id, call.data)
+    await asyncio.gather(bot.answer_callback_query(call.id), send_replies(cid, replies))
+
+async def main():
+    # Схема БД без индексов и ограничений из migrate_config работает, но медленно
+    if await run_logic(pending_migrations):
+        print('Внимание: схема БД устарела, выполните `python migrate_config.py upgrade`')
+    # Загружаем общий словарь в кэш до приёма первых сообщений (пулы вариантов ответа рассчитываются в фоне)
+    await run_logic(refresh_vocabulary, True)
+
+    # Прогресс длительных операций (импорта) приходит из потоков бизнес-логики
+    loop = asyncio.get_running_loop()
+    quiz.set_notifier(lambda cid, replies: asyncio.run_coroutine_threadsafe(send_replies(cid, replies), loop))
+
+    metrics_config.register_gauges('translation_cache', translation_cache_stats)
+    metrics_config.register_gauges('log', log_stats)
+    metrics_config.register_gauges('outbox', send_stats)
+    metrics_config.register_gauges('prefetch', prefetch_stats)
+    metrics_config.start_metrics_server()
+
+    print('Bot is running (asyncio)...')
+    await bot.infinity_polling()
+
+if __name__ == '__main__':
+    asyncio.run(main())
\ No newline at end of file
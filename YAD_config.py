@@ -1,25 +1,184 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
 import requests
+from requests.adapters import HTTPAdapter
 from common_config import load_data_from_file
+from metrics_config import timed
+from dictionary_config import lookup as local_lookup, add_to_overlay, dictionary_stats
 
 """ Основные функции:
 - translate(word): Осуществляет перевод слова с русского на английский через Yandex.Dictionary API.
+- translate_variants(word): Возвращает все варианты перевода [(перевод, часть речи), ...], основной - первый.
+- translate_entry(word): Возвращает (слово, варианты перевода) или None - для пакетного перевода в пуле потоков.
+- translation_cache_stats(): Возвращает счётчики попаданий/промахов кэша переводов.
+
+Перевод сначала ищется в локальном словаре (dictionary_config), затем в кэше, и только потом
+запрашивается у API; найденный через API перевод добавляется в локальный словарь. Варианты из кэша
+дополняют перевод из локального словаря, а отрицательный результат в кэше его не скрывает.
+Из ответа API сохраняются все варианты перевода и синонимы с частью речи, поэтому повторно
+спрашивать API о других допустимых переводах не нужно.
+Переводы кэшируются в два уровня: LRU в памяти процесса и SQLite-файл на диске.
+Отрицательные результаты ("перевод не найден") хранятся NEGATIVE_CACHE_TTL секунд; ошибки API
+(HTTP-статус ошибки или поле code в ответе) не кэшируются.
 """
 
 # Функция перевода слова с Yandex.Dictionary
 url = 'https://dictionary.yandex.net/api/v1/dicservice.json/lookup'
 token_YAD = load_data_from_file('token_YAD.txt')
 
-def translate(word):
+TRANSLATION_CACHE_FILE = 'translation_cache.sqlite3'
+TRANSLATION_LRU_SIZE = 10000
+NEGATIVE_CACHE_TTL = 24 * 60 * 60
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Пул keep-alive соединений для запросов к API
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+_lock = threading.Lock()
+_lru = OrderedDict()
+
+_disk = sqlite3.connect(TRANSLATION_CACHE_FILE, check_same_thread=False)
+_disk.execute("CREATE TABLE IF NOT EXISTS translations ("
+              "word TEXT PRIMARY KEY, translation TEXT, fetched_at REAL NOT NULL)")
+# Кэш, созданный до сохранения всех вариантов, дополняем колонкой с вариантами в JSON
+if 'variants' not in {row[1] for row in _disk.execute("PRAGMA table_info(translations)")}:
+    _disk.execute("ALTER TABLE translations ADD COLUMN variants TEXT")
+_disk.commit()
+
+stats = {
+    'memory_hits': 0,
+    'disk_hits': 0,
+    'negative_hits': 0,
+    'api_calls': 0,
+    'api_errors': 0,
+}
+
+# Запись кэша актуальна, если перевод найден или не истёк срок отрицательного результата
+def _is_fresh(variants, fetched_at):
+    return bool(variants) or time.time() - fetched_at < NEGATIVE_CACHE_TTL
+
+def _remember(word, variants, fetched_at):
+    _lru[word] = (variants, fetched_at)
+    _lru.move_to_end(word)
+    while len(_lru) > TRANSLATION_LRU_SIZE:
+        _lru.popitem(last=False)
+
+def _row_variants(translation, variants):
+    if variants is not None:
+        return [tuple(variant) for variant in json.loads(variants)]
+    return [(translation, None)] if translation is not None else []
+
+# Ищем варианты перевода в кэше: сначала в памяти, затем на диске
+def _cache_lookup(word):
+    with _lock:
+        cached = _lru.get(word)
+        if cached is not None and _is_fresh(*cached):
+            _lru.move_to_end(word)
+            stats['memory_hits'] += 1
+            if not cached[0]:
+                stats['negative_hits'] += 1
+            return True, cached[0]
+
+        row = _disk.execute("SELECT translation, variants, fetched_at FROM translations WHERE word = ?",
+                            (word,)).fetchone()
+        if row is not None:
+            variants = _row_variants(row[0], row[1])
+            if _is_fresh(variants, row[2]):
+                _remember(word, variants, row[2])
+                stats['disk_hits'] += 1
+                if not variants:
+                    stats['negative_hits'] += 1
+                return True, variants
 
+    return False, []
+
+def _cache_store(word, variants):
+    fetched_at = time.time()
+    translation = variants[0][0] if variants else None
+    with _lock:
+        _remember(word, variants, fetched_at)
+        _disk.execute("INSERT OR REPLACE INTO translations (word, translation, variants, fetched_at) "
+                      "VALUES (?, ?, ?, ?)",
+                      (word, translation, json.dumps(variants, ensure_ascii=False), fetched_at))
+        _disk.commit()
+
+# Запрос к Yandex.Dictionary API: все переводы и их синонимы по всем частям речи, без повторов
+@timed('external', 'yandex_lookup')
+def _fetch_translation(word):
     params = {
         'key': token_YAD,
         'lang': 'ru-en',
         'text': word
     }
 
-    response = requests.get(url, params = params).json()
-    if 'def' in response and len(response['def']) > 0 and 'tr' in response['def'][0]:
-        trans_word = response['def'][0]['tr'][0].get('text')
-        return trans_word
-    else:
-        return None
\ No newline at end of file
+    with _lock:
+        stats['api_calls'] += 1
+    response = http_session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    # Ошибка API (неверный или заблокированный ключ, исчерпан лимит) - не "перевод не найден"
+    response.raise_for_status()
+    response = response.json()
+    if response.get('code', 200) != 200:
+        raise ValueError(f"Yandex.Dictionary {response.get('code')}: {response.get('message')}")
+
+    variants = []
+    seen = set()
+    for definition in response.get('def', []):
+        for translation in definition.get('tr', []):
+            for item in [translation] + translation.get('syn', []):
+                text = (item.get('text') or '').strip()
+                if text and text.lower() not in seen:
+                    seen.add(text.lower())
+                    variants.append((text, item.get('pos') or definition.get('pos')))
+    return variants
+
+def translate_variants(word):
+    key = word.strip().lower()
+
+    # Локальный словарь хранит только основной перевод, кэш - все варианты из ответа API
+    translation = local_lookup(key)
+    found, variants = _cache_lookup(key)
+    if translation is not None:
+        same = [variant for variant in variants if variant[0].lower() == translation.lower()]
+        others = [variant for variant in variants if variant[0].lower() != translation.lower()]
+        return [(translation, same[0][1] if same else None)] + others
+    if found:
+        return variants
+
+    try:
+        variants = _fetch_translation(key)
+    except (requests.RequestException, ValueError) as e:
+        # Сетевые ошибки и ошибки API не кэшируем: при следующем запросе попробуем снова
+        with _lock:
+            stats['api_errors'] += 1
+        print(f'Ошибка {e}')
+        return []
+
+    _cache_store(key, variants)
+    if variants:
+        add_to_overlay(key, variants[0][0])
+    return variants
+
+# Переводим слово: (слово, все варианты перевода) или None, если перевод не найден
+def translate_entry(word):
+    variants = translate_variants(word)
+    if not variants:
+        return None
+    return word, variants
+
+# Локальный словарь работает и без сети, и без ключа API: его перевод всегда основной
+def translate(word):
+    variants = translate_variants(word)
+    return variants[0][0] if variants else None
+
+def translation_cache_stats():
+    with _lock:
+        result = dict(stats)
+    local = dictionary_stats()
+    result['local_hits'] = local['hits'] + local['overlay_hits']
+    result['local_words'] = local['words'] + local['overlay_words']
+    return result
@@ -0,0 +1,219 @@
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from common_config import normalize_answer
+from distractor_config import index_words, index_word
+
+"""
+Основные функции:
+- load_vocabulary(rows, translations=()): Загружает общий словарь (id, русское слово, английское слово)
+  и варианты перевода (id слова, перевод) в кэш.
+- add_to_vocabulary(word_id, russian_word, english_word, variants=None): Добавляет новое слово в кэш.
+- accepted_answers(word_id): Возвращает множество нормализованных допустимых ответов для слова.
+- get_translation(russian_word): Возвращает перевод слова из кэша.
+- get_word_id(russian_word): Возвращает id слова общего словаря из кэша.
+- vocabulary_needs_check(): Проверяет, пора ли сверить кэш с БД согласно политике обновления.
+- mark_vocabulary_checked(): Отмечает, что кэш сверен с БД и актуален.
+- vocabulary_version(): Возвращает версию загруженного словаря (количество слов, максимальный id).
+- invalidate_vocabulary(): Помечает кэш как устаревший.
+- load_user_index(cid, user_id, word_ids): Загружает индекс слов пользователя.
+- get_user_index(cid): Возвращает индекс слов пользователя (или None, если его нет в кэше).
+- add_to_user_index(cid, word_id): Добавляет слово в индекс пользователя.
+- remove_from_user_index(cid, word_id): Удаляет слово из индекса пользователя.
+- random_user_word_id(entry, exclude_word_id=None): Возвращает id случайного слова из индекса пользователя за O(1),
+  кроме exclude_word_id (если это не единственное слово).
+- drop_user_index(cid): Удаляет индекс пользователя из кэша.
+
+Политики обновления (VOCAB_REFRESH_POLICY):
+- 'version': раз в VOCAB_REFRESH_INTERVAL секунд сверяем с БД версию словаря и перечитываем его только при расхождении.
+- 'ttl': раз в VOCAB_REFRESH_INTERVAL секунд перечитываем словарь целиком.
+- 'manual': словарь загружается один раз, обновление только через invalidate_vocabulary().
+"""
+
+VOCAB_REFRESH_POLICY = 'version'
+VOCAB_REFRESH_INTERVAL = 60
+
+_lock = threading.Lock()
+
+# Русское слово -> английский перевод и id слова
+_ru_to_en = {}
+_ru_to_id = {}
+# id слова -> (русское слово, английский перевод)
+_words_by_id = {}
+# id слова -> frozenset допустимых ответов (normalize_answer); одинаковые строки разделяются между словами
+_accepted = {}
+
+_version = None
+_checked_at = None
+
+# Индексы слов пользователей: cid -> {'user_id', 'ids', 'pos', 'loaded_at'} с вытеснением LRU
+USER_INDEX_MAX_USERS = 10000
+USER_INDEX_TTL = 300
+
+_user_index = OrderedDict()
+
+def _accepted_set(english_word, variants=()):
+    return frozenset(sys.intern(normalize_answer(answer)) for answer in [english_word, *variants])
+
+# Загружаем словарь в кэш (полная замена содержимого)
+def load_vocabulary(rows, translations=()):
+    global _ru_to_en, _ru_to_id, _words_by_id, _accepted, _version, _checked_at
+
+    ru_to_en = {}
+    ru_to_id = {}
+    words_by_id = {}
+    english_words = []
+    max_id = None
+
+    for word_id, russian_word, english_word in rows:
+        ru_to_en[russian_word] = english_word
+        ru_to_id[russian_word] = word_id
+        words_by_id[word_id] = (russian_word, english_word)
+        english_words.append(english_word)
+        if max_id is None or word_id > max_id:
+            max_id = word_id
+
+    variants = {}
+    for word_id, english_word in translations:
+        variants.setdefault(word_id, []).append(english_word)
+    accepted = {word_id: _accepted_set(english_word, variants.get(word_id, ()))
+                for word_id, (_, english_word) in words_by_id.items()}
+
+    # Подменяем ссылки целиком, чтобы читатели не видели частично заполненный кэш
+    with _lock:
+        _ru_to_en = ru_to_en
+        _ru_to_id = ru_to_id
+        _words_by_id = words_by_id
+        _accepted = accepted
+        _version = (len(words_by_id), max_id)
+        _checked_at = time.monotonic()
+
+    index_words(english_words)
+
+# Добавляем в кэш новое слово, созданное в БД текущим процессом
+def add_to_vocabulary(word_id, russian_word, english_word, variants=None):
+    global _version
+
+    with _lock:
+        if word_id in _words_by_id:
+            return
+
+        _ru_to_en[russian_word] = english_word
+        _ru_to_id[russian_word] = word_id
+        _words_by_id[word_id] = (russian_word, english_word)
+        _accepted[word_id] = _accepted_set(english_word, variants or ())
+
+        if _version is not None:
+            count, max_id = _version
+            _version = (count + 1, word_id if max_id is None else max(max_id, word_id))
+
+    index_word(english_word)
+
+# Получаем перевод русского слова из кэша
+def get_translation(russian_word):
+    return _ru_to_en.get(russian_word)
+
+# Получаем id слова общего словаря по русской форме
+def get_word_id(russian_word):
+    return _ru_to_id.get(russian_word)
+
+# Допустимые ответы на вопрос о слове: проверка ответа - поиск во множестве
+def accepted_answers(word_id):
+    return _accepted.get(word_id)
+
+# Получаем пару (русское слово, перевод) по id слова
+def get_word(word_id):
+    return _words_by_id.get(word_id)
+
+def vocabulary_needs_check():
+    if _checked_at is None:
+        return True
+    if VOCAB_REFRESH_POLICY == 'manual':
+        return False
+    return time.monotonic() - _checked_at >= VOCAB_REFRESH_INTERVAL
+
+def mark_vocabulary_checked():
+    global _checked_at
+    _checked_at = time.monotonic()
+
+def vocabulary_version():
+    return _version
+
+def invalidate_vocabulary():
+    global _checked_at, _version
+    with _lock:
+        _checked_at = None
+        _version = None
+
+# Загружаем индекс слов пользователя: массив id слов и позиция каждого id в массиве
+def load_user_index(cid, user_id, word_ids):
+    ids = list(word_ids)
+    entry = {
+        'user_id': user_id,
+        'ids': ids,
+        'pos': {word_id: i for i, word_id in enumerate(ids)},
+        'loaded_at': time.monotonic(),
+    }
+
+    with _lock:
+        _user_index[cid] = entry
+        _user_index.move_to_end(cid)
+        while len(_user_index) > USER_INDEX_MAX_USERS:
+            _user_index.popitem(last=False)
+
+    return entry
+
+def get_user_index(cid):
+    with _lock:
+        entry = _user_index.get(cid)
+        if entry is None:
+            return None
+
+        # Индекс мог устареть, если словарь менял другой процесс
+        if time.monotonic() - entry['loaded_at'] >= USER_INDEX_TTL:
+            del _user_index[cid]
+            return None
+
+        _user_index.move_to_end(cid)
+        return entry
+
+def add_to_user_index(cid, word_id):
+    with _lock:
+        entry = _user_index.get(cid)
+        if entry is None or word_id in entry['pos']:
+            return
+
+        entry['pos'][word_id] = len(entry['ids'])
+        entry['ids'].append(word_id)
+
+# Удаляем слово за O(1): на его место переносим последний элемент массива
+def remove_from_user_index(cid, word_id):
+    with _lock:
+        entry = _user_index.get(cid)
+        if entry is None or word_id not in entry['pos']:
+            return
+
+        ids = entry['ids']
+        pos = entry['pos'].pop(word_id)
+        last_id = ids.pop()
+        if last_id != word_id:
+            ids[pos] = last_id
+            entry['pos'][last_id] = pos
+
+def random_user_word_id(entry, exclude_word_id=None):
+    with _lock:
+        ids = entry['ids']
+        excluded = entry['pos'].get(exclude_word_id)
+        if excluded is None or len(ids) < 2:
+            return random.choice(ids) if ids else None
+
+        # Выбираем из остальных слов без повторных попыток: позиции после исключённой сдвигаем на одну
+        i = random.randrange(len(ids) - 1)
+        return ids[i + 1] if i >= excluded else ids[i]
+
+def drop_user_index(cid):
+    with _lock:
+        _user_index.pop(cid, None)
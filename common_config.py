@@ -1,9 +1,22 @@
 """
 Основные функции:
 - load_data_from_file(filename): Загружает данные из локального файла.
+- normalize_answer(text): Приводит ответ или вариант перевода к виду для сравнения.
 """
 
+# Артикли, которые не влияют на правильность ответа
+ARTICLES = ('a ', 'an ', 'the ')
+ANSWER_PUNCTUATION = ' .,!?;:"\''
+
 # Функция для получения данных из локального файла
 def load_data_from_file(filename):
     with open(filename, 'r', encoding='utf-8') as file:
-        return file.read()
\ No newline at end of file
+        return file.read()
+
+# Сравниваем ответы без учёта регистра, ё/е, лишних пробелов, знаков препинания по краям и артикля
+def normalize_answer(text):
+    text = ' '.join(text.lower().replace('ё', 'е').strip(ANSWER_PUNCTUATION).split())
+    for article in ARTICLES:
+        if text.startswith(article):
+            return text[len(article):]
+    return text
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+"""
+Локальный словарь ru→en - первый уровень перевода в YAD_config.translate.
+
+Словарь собирается заранее (build_dictionary) из списка пар "русское слово, перевод" в компактный файл:
+заголовок, таблица смещений записей и сами записи "слово\\tперевод\\n", отсортированные по байтам UTF-8.
+Файл отображается в память (mmap) только для чтения: страницы делят все процессы бота на машине,
+а поиск - двоичный поиск по таблице смещений без загрузки словаря в память процесса (единицы микросекунд).
+
+Переводы, полученные от Yandex.Dictionary, дописываются строкой в файл дополнений DICTIONARY_OVERLAY_FILE.
+Дополнения хранятся в памяти; новые строки, дописанные другими процессами, подчитываются при промахе.
+Следующая сборка словаря включает дополнения в основной файл.
+
+Основные функции:
+- build_dictionary(sources, path=DICTIONARY_FILE, overlay=DICTIONARY_OVERLAY_FILE): Собирает файл словаря из списков пар.
+- load_dictionary(path=DICTIONARY_FILE): Отображает файл словаря в память (при запуске и после пересборки).
+- lookup(word): Возвращает перевод из локального словаря или None.
+- add_to_overlay(word, translation): Запоминает перевод, полученный от внешнего API.
+- dictionary_stats(): Возвращает размер словаря, дополнений и счётчики поиска.
+
+Пример:
+    python dictionary_config.py build ru_en.tsv [ещё файлы...]
+    python dictionary_config.py lookup яблоко
+"""
+
+DICTIONARY_FILE = 'ru_en.dict'
+DICTIONARY_OVERLAY_FILE = 'ru_en_overlay.tsv'
+DICTIONARY_MAGIC = b'RUEN0001'
+# Заголовок: сигнатура и число записей; далее число записей смещений uint32 (little-endian)
+HEADER = struct.Struct('<8sI')
+OFFSET = struct.Struct('<I')
+MAX_WORD_BYTES = 255
+
+_lock = threading.Lock()
+# (отображение файла, таблица смещений, начало записей); заменяется целиком при перезагрузке
+_index = None
+_overlay = {}
+_overlay_position = 0
+
+stats = {
+    'lookups': 0,
+    'hits': 0,
+    'overlay_hits': 0,
+}
+
+def _normalize(word):
+    return ' '.join(word.strip().lower().split())
+
+# Разбираем строку списка: "слово<TAB>перевод" или CSV "слово,перевод[,...]"
+def _read_pairs(source):
+    with open(source, 'r', encoding='utf-8-sig', newline='') as file:
+        dialect = 'excel-tab' if source.endswith(('.tsv', '.txt')) else 'excel'
+        for row in csv.reader(file, dialect):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            word, translation = _normalize(row[0]), row[1].strip().lower()
+            if word and translation and '\t' not in translation and '\n' not in translation:
+                yield word, translation
+
+def build_dictionary(sources, path=DICTIONARY_FILE, overlay=DICTIONARY_OVERLAY_FILE):
+    entries = {}
+    # Первый перевод слова считается основным; дополнения не перекрывают собранный словарь
+    for source in list(sources) + ([overlay] if overlay and os.path.exists(overlay) else []):
+        for word, translation in _read_pairs(source):
+            entries.setdefault(word, translation)
+
+    records = sorted((word.encode('utf-8'), translation.encode('utf-8')) for word, translation in entries.items()
+                     if len(word.encode('utf-8')) <= MAX_WORD_BYTES)
+
+    # Пишем во временный файл и подменяем атомарно: процессы со старым отображением продолжают работать
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(DICTIONARY_MAGIC, len(records)))
+        offset = 0
+        for word, translation in records:
+            file.write(OFFSET.pack(offset))
+            offset += len(word) + len(translation) + 2
+        for word, translation in records:
+            file.write(word + b'\t' + translation + b'\n')
+    os.replace(temporary, path)
+    return len(records)
+
+def load_dictionary(path=DICTIONARY_FILE):
+    global _index
+
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return 0
+
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, count = HEADER.unpack_from(mapped, 0)
+    if magic != DICTIONARY_MAGIC:
+        mapped.close()
+        print(f'Ошибка: {path} не является файлом словаря')
+        return 0
+
+    data_start = HEADER.size + count * OFFSET.size
+    if sys.byteorder == 'little':
+        # Таблица смещений читается прямо из отображения, без копирования в память процесса
+        offsets = memoryview(mapped)[HEADER.size:data_start].cast('I')
+    else:
+        offsets = array('I', mapped[HEADER.size:data_start])
+        offsets.byteswap()
+
+    # Старое отображение не закрываем: в нём может идти поиск, его освободит сборщик мусора
+    _index = (mapped, offsets, data_start)
+    return count
+
+# Двоичный поиск по отсортированным ключам в отображённом файле
+def _search(mapped, offsets, data_start, key):
+    low, high = 0, len(offsets)
+    while low < high:
+        middle = (low + high) // 2
+        start = data_start + offsets[middle]
+        separator = mapped.find(b'\t', start)
+        current = mapped[start:separator]
+        if current < key:
+            low = middle + 1
+        elif current > key:
+            high = middle
+        else:
+            return mapped[separator + 1:mapped.find(b'\n', separator)].decode('utf-8')
+    return None
+
+# Подчитываем строки, дописанные в файл дополнений (в том числе другими процессами)
+def _refresh_overlay():
+    global _overlay_position
+
+    try:
+        if os.path.getsize(DICTIONARY_OVERLAY_FILE) <= _overlay_position:
+            return
+        with open(DICTIONARY_OVERLAY_FILE, 'rb') as file:
+            file.seek(_overlay_position)
+            data = file.read()
+    except OSError:
+        return
+
+    # Недописанную последнюю строку оставляем до следующего раза
+    complete = data[:data.rfind(b'\n') + 1]
+    _overlay_position += len(complete)
+    for line in complete.decode('utf-8', errors='replace').splitlines():
+        word, _, translation = line.partition('\t')
+        if word and translation:
+            _overlay.setdefault(word, translation)
+
+def lookup(word):
+    key = _normalize(word)
+    index = _index
+    # Отображение только читается, поэтому поиск в нём не требует блокировки
+    translation = _search(*index, key.encode('utf-8')) if index is not None else None
+
+    with _lock:
+        stats['lookups'] += 1
+        if translation is not None:
+            stats['hits'] += 1
+            return translation
+
+        translation = _overlay.get(key)
+        if translation is None:
+            _refresh_overlay()
+            translation = _overlay.get(key)
+        if translation is not None:
+            stats['overlay_hits'] += 1
+        return translation
+
+def add_to_overlay(word, translation):
+    key = _normalize(word)
+    translation = translation.strip().lower()
+    if not key or not translation or '\t' in translation or '\n' in translation:
+        return
+
+    with _lock:
+        _refresh_overlay()
+        if key in _overlay:
+            return
+        _overlay[key] = translation
+        try:
+            # Одна строка одной записью в режиме дозаписи: строки разных процессов не перемешиваются
+            with open(DICTIONARY_OVERLAY_FILE, 'ab') as file:
+                line = f'{key}\t{translation}\n'.encode('utf-8')
+                file.write(line)
+        except OSError as e:
+            print(f'Ошибка {e}')
+
+def dictionary_stats():
+    with _lock:
+        result = dict(stats)
+        result['words'] = len(_index[1]) if _index is not None else 0
+        result['overlay_words'] = len(_overlay)
+    return result
+
+# Отображаем собранный словарь при запуске
+load_dictionary()
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный словарь ru→en')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='собрать словарь из файлов .tsv/.txt (табуляция) или .csv')
+    build.add_argument('sources', nargs='+', help='файлы со строками "русское слово, перевод"')
+    build.add_argument('--out', default=DICTIONARY_FILE, help='файл словаря')
+    build.add_argument('--no-overlay', action='store_true', help='не включать переводы из файла дополнений')
+    find = subparsers.add_parser('lookup', help='найти перевод слова')
+    find.add_argument('word')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_dictionary(args.sources, args.out, overlay=None if args.no_overlay else DICTIONARY_OVERLAY_FILE)
+        print(f'Словарь {args.out}: {count} слов')
+    else:
+        print(lookup(args.word))
+
+if __name__ == '__main__':
+    main()
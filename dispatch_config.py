@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+
+import telebot
+
+"""
+Диспетчер обновлений с разбиением по чатам.
+
+Пул потоков telebot (threaded=True) может одновременно выполнять два обновления одного чата: например,
+ответ на вопрос и нажатие "Дальше", отправленные подряд, гоняются за состояние вопроса.
+ShardedTeleBot распределяет обновления по DISPATCH_SHARDS очередям по id чата: у каждой очереди
+свой поток, поэтому обновления одного чата выполняются строго по очереди, а разные чаты - параллельно.
+Глубина каждой очереди и задержка обработки доступны через dispatch_stats() (метрики и /stats webhook).
+
+Основные функции:
+- update_chat_id(update): Возвращает id чата, к которому относится обновление.
+- ShardedTeleBot(token, shards, queue_size): TeleBot, который обрабатывает обновления в потоках-шардах.
+- ShardedTeleBot.submit(update, block=True): Ставит обновление в очередь шарда его чата.
+- ShardedTeleBot.process_now(updates): Обрабатывает обновления в текущем потоке, минуя очереди.
+- ShardedTeleBot.dispatch_stats(): Возвращает глубину очередей и счётчики обработки.
+"""
+
+DISPATCH_SHARDS = 16
+DISPATCH_QUEUE_SIZE = 1000
+
+MESSAGE_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+def update_chat_id(update):
+    for field in MESSAGE_FIELDS:
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+
+    call = update.callback_query
+    if call is not None:
+        return call.message.chat.id if call.message is not None else call.from_user.id
+
+    # Прочие обновления не относятся к чату и распределяются по своему номеру
+    return update.update_id
+
+class ShardedTeleBot(telebot.TeleBot):
+    def __init__(self, token, shards=DISPATCH_SHARDS, queue_size=DISPATCH_QUEUE_SIZE, **kwargs):
+        # Обработчики выполняются в потоке шарда, собственный пул потоков telebot не нужен
+        kwargs['threaded'] = False
+        super().__init__(token, **kwargs)
+
+        self._shards = [queue.Queue(maxsize=queue_size) for _ in range(shards)]
+        self._shard_threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'processed': 0,
+            'failed': 0,
+            'lag_total': 0.0,
+            'lag_max': 0.0,
+        }
+
+    def _start_shards(self):
+        with self._start_lock:
+            if self._shard_threads:
+                return
+            for i, shard in enumerate(self._shards):
+                thread = threading.Thread(target=self._shard_worker, args=(shard,), name=f'shard-{i}', daemon=True)
+                thread.start()
+                self._shard_threads.append(thread)
+
+    def _shard_worker(self, shard):
+        while True:
+            update, received_at = shard.get()
+            lag = time.monotonic() - received_at
+            try:
+                self.process_now([update])
+                failed = 0
+            except Exception as e:
+                failed = 1
+                print(f'Ошибка {e}')
+            finally:
+                shard.task_done()
+
+            with self._stats_lock:
+                self._stats['processed'] += 1
+                self._stats['failed'] += failed
+                self._stats['lag_total'] += lag
+                self._stats['lag_max'] = max(self._stats['lag_max'], lag)
+
+    # Выбрасывает queue.Full, если block=False и очередь шарда заполнена
+    def submit(self, update, block=True):
+        if not self._shard_threads:
+            self._start_shards()
+
+        shard = self._shards[hash(update_chat_id(update)) % len(self._shards)]
+        shard.put((update, time.monotonic()), block=block)
+
+    # Вызывается polling-циклом telebot: запоминаем номер обновления, чтобы не получить его повторно,
+    # и сразу возвращаемся, не дожидаясь обработки
+    def process_new_updates(self, updates):
+        for update in updates:
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.submit(update)
+
+    def process_now(self, updates):
+        super().process_new_updates(updates)
+
+    # Ждём, пока все поставленные в очереди обновления будут обработаны
+    def join(self):
+        for shard in self._shards:
+            shard.join()
+
+    def dispatch_stats(self):
+        with self._stats_lock:
+            result = dict(self._stats)
+        depths = [shard.qsize() for shard in self._shards]
+
+        result['shards'] = len(depths)
+        result['queue_depth'] = sum(depths)
+        result['queue_depth_max'] = max(depths)
+        result['lag_avg'] = result['lag_total'] / result['processed'] if result['processed'] else 0.0
+        for i, depth in enumerate(depths):
+            result[f'shard_{i}_depth'] = depth
+        return result
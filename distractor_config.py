@@ -0,0 +1,198 @@
+import random
+import threading
+from collections import deque
+
+from common_config import normalize_answer
+
+"""
+Индекс отвлекающих вариантов ответа (дистракторов) для вопросов квиза.
+
+Для каждого английского слова заранее подбирается небольшой пул похожих слов (близкая длина,
+общий префикс, общие биграммы). Во время вопроса три варианта берутся из пула за O(1),
+правильный ответ в пул никогда не попадает.
+
+Кандидаты ищутся не по всему словарю, а по корзинам: слова с тем же двухбуквенным префиксом
+и слова той же длины. Новые слова добавляются в корзины и предлагаются в пулы соседей инкрементально.
+Перезагрузка словаря сохраняет пулы оставшихся слов: индексируются только новые слова, а удалённые
+убираются из корзин и пулов. Слова без пула стоят в очереди, которую пакетно обрабатывает фоновый поток.
+
+Основные функции:
+- index_words(english_words): Приводит индекс к новому составу словаря и в фоне рассчитывает недостающие пулы.
+- index_word(english_word): Добавляет новое слово в индекс.
+- pick_distractors(english_word, k, exclude): Возвращает k отвлекающих вариантов для правильного ответа,
+  кроме допустимых ответов из exclude (нормализованных normalize_answer).
+- rebuild_distractors(batch_size): Пакетно рассчитывает пулы для слов из очереди слов без пула.
+- rebuild_in_background(): Запускает rebuild_distractors в фоновом потоке, если он ещё не запущен.
+"""
+
+DISTRACTOR_POOL_SIZE = 12
+CANDIDATE_LIMIT = 100
+REBUILD_BATCH_SIZE = 100
+
+_lock = threading.Lock()
+_words = set()
+_word_list = []
+_bigram_sets = {}
+_by_prefix = {}
+_by_length = {}
+# Английское слово -> список похожих слов
+_pools = {}
+# Слова, пул которых ещё не рассчитан
+_unpooled = deque()
+_rebuild_thread = None
+
+def _bigrams(word):
+    return {word[i:i + 2] for i in range(len(word) - 1)}
+
+def _common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+# Чем выше оценка, тем правдоподобнее слово как неправильный вариант ответа
+def similarity(a, b):
+    bigrams_a = _bigram_sets.get(a) or _bigrams(a)
+    bigrams_b = _bigram_sets.get(b) or _bigrams(b)
+    union = len(bigrams_a) + len(bigrams_b)
+    shared = len(bigrams_a & bigrams_b)
+    jaccard = shared / (union - shared) if union > shared else 0.0
+    return 2 * min(_common_prefix(a, b), 3) + 3 * jaccard - 0.5 * abs(len(a) - len(b))
+
+def _add_to_buckets(word):
+    _words.add(word)
+    _bigram_sets[word] = _bigrams(word)
+    _word_list.append(word)
+    _by_prefix.setdefault(word[:2], []).append(word)
+    _by_length.setdefault(len(word), []).append(word)
+
+def _candidates(word):
+    candidates = set()
+    for bucket in (_by_prefix.get(word[:2], []), _by_length.get(len(word), [])):
+        if len(bucket) > CANDIDATE_LIMIT:
+            bucket = random.sample(bucket, CANDIDATE_LIMIT)
+        candidates.update(bucket)
+    candidates.discard(word)
+    return candidates
+
+def _build_pool(word):
+    candidates = _candidates(word)
+    return sorted(candidates, key=lambda other: similarity(word, other), reverse=True)[:DISTRACTOR_POOL_SIZE]
+
+# Удалённые слова убираем из корзин и из пулов оставшихся слов (перестройка корзин - O(N), удаления редки)
+def _remove_words(removed):
+    _words.difference_update(removed)
+    for word in removed:
+        _bigram_sets.pop(word, None)
+        _pools.pop(word, None)
+
+    _word_list[:] = [word for word in _word_list if word not in removed]
+    _by_prefix.clear()
+    _by_length.clear()
+    for word in _word_list:
+        _by_prefix.setdefault(word[:2], []).append(word)
+        _by_length.setdefault(len(word), []).append(word)
+
+    for word, pool in _pools.items():
+        if any(other in removed for other in pool):
+            _pools[word] = [other for other in pool if other not in removed]
+
+def _index_word(english_word):
+    _add_to_buckets(english_word)
+    _pools[english_word] = _build_pool(english_word)
+
+    for other in _pools[english_word]:
+        pool = _pools.get(other)
+        if pool is None:
+            continue
+        if len(pool) < DISTRACTOR_POOL_SIZE:
+            pool.append(english_word)
+        elif similarity(other, english_word) > similarity(other, pool[-1]):
+            pool[-1] = english_word
+            pool.sort(key=lambda candidate: similarity(other, candidate), reverse=True)
+
+# Перезагрузка словаря: пулы оставшихся слов сохраняются. Несколько новых слов индексируем сразу,
+# а большую пачку (первая загрузка, импорт в другом процессе) ставим в очередь фонового пересчёта
+def index_words(english_words):
+    english_words = set(english_words)
+
+    with _lock:
+        removed = _words - english_words
+        added = english_words - _words
+        if removed:
+            _remove_words(removed)
+
+        if len(added) <= REBUILD_BATCH_SIZE:
+            for word in added:
+                _index_word(word)
+        else:
+            for word in added:
+                _add_to_buckets(word)
+            _unpooled.extend(added)
+        queued = bool(_unpooled)
+
+    if queued:
+        rebuild_in_background()
+
+# Новое слово получает свой пул и предлагается в пулы соседей, если оно похоже сильнее их худшего варианта
+def index_word(english_word):
+    with _lock:
+        if english_word not in _words:
+            _index_word(english_word)
+
+def pick_distractors(english_word, k=3, exclude=()):
+    word = english_word.lower()
+
+    with _lock:
+        pool = _pools.get(word)
+        if pool is None:
+            pool = _build_pool(word)
+            if word in _words:
+                _pools[word] = pool
+
+        # Синоним правильного ответа тоже был бы правильным вариантом
+        if exclude:
+            pool = [other for other in pool if normalize_answer(other) not in exclude]
+        result = random.sample(pool, min(k, len(pool)))
+
+        # Пул слишком мал: добираем варианты случайными словами словаря, исключая правильный ответ
+        attempts = 0
+        while len(result) < k and attempts < 10 * k and _word_list:
+            attempts += 1
+            other = random.choice(_word_list)
+            if other != word and other not in result and normalize_answer(other) not in exclude:
+                result.append(other)
+
+    return result
+
+# Пакетно рассчитываем пулы для слов из очереди (можно прерывать и запускать снова). Блокировка берётся
+# на один пакет, поэтому pick_distractors не ждёт весь пересчёт
+def rebuild_distractors(batch_size=REBUILD_BATCH_SIZE):
+    global _rebuild_thread
+
+    built = 0
+    while True:
+        with _lock:
+            if not _unpooled:
+                # Фоновый поток снимает отметку о себе под блокировкой: слова, поставленные в очередь позже,
+                # запустят новый поток
+                if _rebuild_thread is threading.current_thread():
+                    _rebuild_thread = None
+                return built
+            for _ in range(min(batch_size, len(_unpooled))):
+                word = _unpooled.popleft()
+                # Пул мог появиться раньше (pick_distractors), а слово - исчезнуть из словаря
+                if word in _words and word not in _pools:
+                    _pools[word] = _build_pool(word)
+                    built += 1
+
+def rebuild_in_background():
+    global _rebuild_thread
+
+    with _lock:
+        if _rebuild_thread is not None:
+            return
+        _rebuild_thread = threading.Thread(target=rebuild_distractors, name='distractors', daemon=True)
+        _rebuild_thread.start()
@@ -0,0 +1,106 @@
+import csv
+import io
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from YAD_config import translate_entry
+from psql_config import words_by_russian, insert_words_batch, attach_user_words, WORD_MAX_LENGTH
+from log_config import log_event
+
+"""
+Массовый импорт слов в персональный словарь пользователя (команда /import).
+
+Список (вставленный текст или файл .txt/.csv) разбирается построчно, без загрузки в память целиком
+сверх IMPORT_MAX_WORDS слов. Порция слов сверяется с общим словарём одним запросом, переводятся только
+отсутствующие слова - в общем для всех импортов пуле из IMPORT_WORKERS потоков, новые слова и связи
+с пользователем записываются пакетными INSERT. Слова с переводом длиннее столбца words.english_word
+пропускаются (too_long): иначе БД отвергла бы весь пакет. Ход импорта передаётся в progress(done, total)
+не чаще раза в IMPORT_PROGRESS_INTERVAL секунд.
+
+Основные функции:
+- parse_word_list(text, csv_format=False): Разбирает список слов: по строкам, через запятую, точку с запятой или табуляцию.
+- decode_document(data): Декодирует загруженный файл (UTF-8 или Windows-1251).
+- import_words(cid, words, progress=None): Добавляет слова в словарь пользователя и возвращает итоги.
+"""
+
+IMPORT_WORKERS = 8
+IMPORT_BATCH_SIZE = 200
+IMPORT_MAX_WORDS = 1000
+IMPORT_MAX_BYTES = 256 * 1024
+IMPORT_PROGRESS_INTERVAL = 2.0
+IMPORT_EXTENSIONS = ('.txt', '.csv')
+
+WORD_SEPARATORS = re.compile(r'[,;\t]')
+# Русское слово или словосочетание длиной не больше столбца words.russian_word
+VALID_WORD = re.compile(r'^[а-яё][а-яё -]{0,39}$')
+
+# Общий пул ограничивает число одновременных запросов к Yandex.Dictionary от всех импортов сразу
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import')
+
+def _split_lines(text, csv_format):
+    lines = io.StringIO(text)
+    if csv_format:
+        # Из CSV берём первый столбец каждой строки
+        for row in csv.reader(lines):
+            if row:
+                yield row[0]
+        return
+
+    for line in lines:
+        yield from WORD_SEPARATORS.split(line)
+
+# Возвращаем уникальные слова в порядке появления; некорректные строки пропускаем
+def parse_word_list(text, csv_format=False):
+    seen = set()
+    for item in _split_lines(text, csv_format):
+        word = ' '.join(item.strip().strip('"\'').lower().split())
+        if word and word not in seen and VALID_WORD.match(word):
+            seen.add(word)
+            yield word
+
+def decode_document(data):
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1251', errors='replace')
+
+def import_words(cid, words, progress=None):
+    words = list(islice(words, IMPORT_MAX_WORDS))
+    result = {'total': len(words), 'added': 0, 'already': 0, 'not_found': [], 'too_long': []}
+    reported_at = time.monotonic()
+
+    for start in range(0, len(words), IMPORT_BATCH_SIZE):
+        batch = words[start:start + IMPORT_BATCH_SIZE]
+
+        # Одним запросом узнаём, какие слова уже есть в общем словаре; переводим только остальные
+        known = words_by_russian(batch)
+        missing = [word for word in batch if word not in known]
+
+        variants = dict(found for found in _executor.map(translate_entry, missing) if found is not None)
+        too_long = [word for word, found in variants.items() if len(found[0][0]) > WORD_MAX_LENGTH]
+        for word in too_long:
+            del variants[word]
+        result['too_long'].extend(too_long)
+
+        pairs = [(word, found[0][0].lower()) for word, found in variants.items()]
+        if pairs:
+            insert_words_batch(pairs, variants)
+            known.update(words_by_russian([word for word, _ in pairs]))
+
+        result['not_found'].extend(word for word in missing if word not in known and word not in too_long)
+
+        word_ids = [known[word][0] for word in batch if word in known]
+        added = attach_user_words(cid, word_ids)
+        result['added'] += added
+        result['already'] += len(word_ids) - added
+
+        done = start + len(batch)
+        if progress is not None and done < len(words) and time.monotonic() - reported_at >= IMPORT_PROGRESS_INTERVAL:
+            progress(done, len(words))
+            reported_at = time.monotonic()
+
+    log_event('import_words', RESULT='imported', USER=cid, TOTAL=result['total'], ADDED=result['added'],
+              ALREADY=result['already'], NOT_FOUND=len(result['not_found']), TOO_LONG=len(result['too_long']))
+    return result
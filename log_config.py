@@ -1,12 +1,164 @@
+import atexit
+import glob
+import gzip
+import json
 import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from datetime import datetime
+
+"""
+Структурированный журнал событий пользователей в формате JSON Lines.
+
+Обработчики не пишут в файл сами: событие кладётся в ограниченную очередь (log_event), а фоновый
+поток записывает события пачками. Файл ротируется по размеру (LOG_MAX_BYTES) или по времени
+(LOG_ROTATE_INTERVAL), старые части сжимаются gzip, хранится LOG_BACKUP_COUNT архивов.
+При переполнении очереди обработчик не ждёт: события уровня INFO сначала прореживаются,
+а при полной очереди отбрасываются. Потери видны в log_stats().
+
+Основные функции:
+- log_event(action, level='info', **details): Записывает событие в журнал.
+- log_stats(): Возвращает счётчики записанных, прореженных и потерянных событий.
+- flush_log(timeout): Дожидается записи накопленных событий.
+
+logger - стандартный logging.Logger, сообщения которого попадают в тот же журнал.
+"""
 
 LOG_FILE_NAME = 'user_logs.log'
-FORMATTER = '%(asctime)s | %(levelname)-8s | %(message)s'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 1.0
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+LOG_BACKUP_COUNT = 14
+
+# Доля заполнения очереди, после которой события INFO сохраняются лишь с вероятностью LOG_SAMPLE_RATE
+LOG_SAMPLE_WATERMARK = 0.8
+LOG_SAMPLE_RATE = 0.1
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_stats_lock = threading.Lock()
+stats = {
+    'written': 0,
+    'sampled_out': 0,
+    'dropped': 0,
+    'rotations': 0,
+}
+
+def _count(name, value=1):
+    with _stats_lock:
+        stats[name] += value
+
+def _enqueue(level, record):
+    # Под нагрузкой прореживаем рядовые события, предупреждения и ошибки сохраняем
+    if level == 'INFO' and _queue.qsize() >= LOG_QUEUE_SIZE * LOG_SAMPLE_WATERMARK:
+        if random.random() >= LOG_SAMPLE_RATE:
+            _count('sampled_out')
+            return
+
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        _count('dropped')
+
+def log_event(action, level='info', **details):
+    level = level.upper()
+    _enqueue(level, {
+        'TIME': time.strftime(DATE_FORMAT),
+        'LEVEL': level,
+        'ACTION': action,
+        'DETAILS': details,
+    })
+
+def log_stats():
+    with _stats_lock:
+        result = dict(stats)
+    result['queued'] = _queue.qsize()
+    return result
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        self.opened_at = time.time()
+
+    def write(self, lines):
+        self.file.write(''.join(lines))
+        self.file.flush()
+
+        if self.file.tell() >= LOG_MAX_BYTES or time.time() - self.opened_at >= LOG_ROTATE_INTERVAL:
+            self.rotate()
+
+    # Переименовываем текущий файл, сжимаем его и удаляем самые старые архивы
+    def rotate(self):
+        self.file.close()
+
+        rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        if os.path.getsize(self.path) > 0:
+            os.replace(self.path, rotated)
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+            _count('rotations')
+
+            archives = sorted(glob.glob(f'{self.path}.*.gz'))
+            for archive in archives[:-LOG_BACKUP_COUNT]:
+                os.remove(archive)
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.opened_at = time.time()
+
+def _run_writer():
+    writer = _Writer(LOG_FILE_NAME)
+    while True:
+        try:
+            batch = [_queue.get(timeout=LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            continue
+
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            writer.write([json.dumps(record, ensure_ascii=False) + '\n' for record in batch])
+            _count('written', len(batch))
+        except Exception as e:
+            _count('dropped', len(batch))
+            print(f'Ошибка {e}')
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+# Ждём, пока фоновый поток запишет накопленные события
+def flush_log(timeout=5):
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+threading.Thread(target=_run_writer, name='log-writer', daemon=True).start()
+atexit.register(flush_log)
+
+# Стандартный логгер пишет в тот же журнал через очередь
+class _QueueLogHandler(logging.Handler):
+    def emit(self, record):
+        try:
+            _enqueue(record.levelname, {
+                'TIME': time.strftime(DATE_FORMAT, time.localtime(record.created)),
+                'LEVEL': record.levelname,
+                'MESSAGE': record.getMessage(),
+            })
+        except Exception:
+            self.handleError(record)
+
 logger = logging.getLogger(__name__)
-handler = logging.FileHandler(LOG_FILE_NAME, mode='a', encoding='utf-8')
-formatter = logging.Formatter(FORMATTER, DATE_FORMAT)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
\ No newline at end of file
+logger.addHandler(_QueueLogHandler())
+logger.setLevel(logging.INFO)
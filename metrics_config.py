@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Метрики бота в формате Prometheus: гистограммы длительности и счётчики вызовов для обработчиков,
+функций работы с БД и внешних вызовов (Yandex.Dictionary, Telegram API).
+
+Метрики включаются флагом METRICS_ENABLED. Когда он выключен, декоратор timed возвращает
+исходную функцию без обёртки, поэтому выключенные метрики ничего не стоят.
+
+Основные функции:
+- timed(kind, name=None): Декоратор, измеряющий длительность вызовов функции.
+- observe(kind, name, seconds, error=False): Учитывает одно измерение вручную.
+- register_gauges(prefix, func): Добавляет в вывод значения, которые возвращает func() (словарь чисел).
+- render_metrics(): Возвращает все метрики в текстовом формате Prometheus.
+- start_metrics_server(host, port): Запускает HTTP-сервер с адресом /metrics.
+"""
+
+METRICS_ENABLED = False
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# (kind, name) -> {'buckets': [...], 'sum': float, 'count': int, 'errors': int}
+_series = {}
+_gauges = {}
+
+def observe(kind, name, seconds, error=False):
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        series = _series.get((kind, name))
+        if series is None:
+            series = _series[(kind, name)] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0, 'errors': 0}
+        if index < len(BUCKETS):
+            series['buckets'][index] += 1
+        series['sum'] += seconds
+        series['count'] += 1
+        if error:
+            series['errors'] += 1
+
+def timed(kind, name=None):
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        metric_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                observe(kind, metric_name, time.perf_counter() - started, error)
+        return wrapper
+    return decorator
+
+def register_gauges(prefix, func):
+    _gauges[prefix] = func
+
+def render_metrics():
+    lines = [
+        '# HELP bot_latency_seconds Call latency by kind (handler, db, external) and name.',
+        '# TYPE bot_latency_seconds histogram',
+    ]
+    with _lock:
+        series = {key: {**value, 'buckets': list(value['buckets'])} for key, value in _series.items()}
+
+    for (kind, name), value in sorted(series.items()):
+        labels = f'kind="{kind}",name="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, value['buckets']):
+            cumulative += count
+            lines.append(f'bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'bot_latency_seconds_bucket{{{labels},le="+Inf"}} {value["count"]}')
+        lines.append(f'bot_latency_seconds_sum{{{labels}}} {value["sum"]}')
+        lines.append(f'bot_latency_seconds_count{{{labels}}} {value["count"]}')
+
+    lines.append('# HELP bot_errors_total Calls that raised an exception.')
+    lines.append('# TYPE bot_errors_total counter')
+    for (kind, name), value in sorted(series.items()):
+        lines.append(f'bot_errors_total{{kind="{kind}",name="{name}"}} {value["errors"]}')
+
+    for prefix, func in sorted(_gauges.items()):
+        try:
+            values = func()
+        except Exception as e:
+            print(f'Ошибка {e}')
+            continue
+        for key, number in sorted(values.items()):
+            if isinstance(number, (int, float)):
+                lines.append(f'# TYPE bot_{prefix}_{key} gauge')
+                lines.append(f'bot_{prefix}_{key} {number}')
+
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    if not METRICS_ENABLED:
+        return None
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f'Metrics are available at http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,314 @@
+import argparse
+import sys
+import time
+
+import sqlalchemy as sq
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from psql_config import engine, Base, UserStats, Translations, reconcile_user_stats
+
+"""
+Версионные миграции схемы БД.
+
+Каждая миграция применяется один раз; применённые версии записываются в таблицу schema_migrations.
+Индексы в PostgreSQL создаются через CREATE INDEX CONCURRENTLY: таблица не блокируется на запись,
+и бот может работать во время миграции. Такие миграции выполняются вне транзакции; недостроенный
+после сбоя (INVALID) индекс удаляется и строится заново при следующем запуске. Одновременный запуск
+миграций из нескольких экземпляров исключает advisory lock.
+
+Проверка (verify) сравнивает индексы в БД с индексами моделей psql_config, ищет недостроенные индексы
+и строит планы известных запросов бота (KNOWN_QUERIES): полный просмотр таблицы вместо поиска по индексу
+считается медленным планом. В PostgreSQL на время проверки отключается seq scan, чтобы на маленьких
+таблицах планировщик не выбирал полный просмотр при наличии подходящего индекса.
+
+Основные функции:
+- applied_migrations(): Возвращает множество применённых версий.
+- pending_migrations(): Возвращает миграции, которые ещё не применены.
+- migrate(): Применяет все неприменённые миграции по порядку.
+- create_index(connection, name, table, columns, unique=False): Создаёт индекс без блокировки таблицы на запись.
+- verify(): Проверяет схему и планы запросов, возвращает список найденных проблем.
+- main(): Запуск из командной строки.
+
+Пример:
+    python migrate_config.py upgrade
+    python migrate_config.py status
+    python migrate_config.py verify
+    python migrate_config.py reconcile    # пересчёт статистики пользователей (psql_config.reconcile_user_stats)
+"""
+
+MIGRATIONS_TABLE = 'schema_migrations'
+# Ключ pg_advisory_lock, общий для всех экземпляров бота
+MIGRATION_LOCK_ID = 0x1E4E
+UNIQUE_INDEX_ATTEMPTS = 3
+
+# Колонки интервального повторения, которых нет в таблицах, созданных до их появления
+SRS_COLUMNS = [
+    ('due', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+    ('ease', 'DOUBLE PRECISION NOT NULL DEFAULT 2.5'),
+    ('interval', 'DOUBLE PRECISION NOT NULL DEFAULT 0'),
+    ('reps', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Запросы горячего пути бота: (функция psql_config, SQL, параметры)
+KNOWN_QUERIES = [
+    ('get_user', "SELECT id, name FROM users WHERE telegram_id = :cid", {'cid': 0}),
+    ('user_word_index', "SELECT word_id FROM user_words WHERE user_id = :user_id", {'user_id': 0}),
+    ('find_word', "SELECT id, english_word FROM words WHERE russian_word = :word", {'word': ''}),
+    ('next_due_word', "SELECT word_id FROM user_words WHERE user_id = :user_id AND due <= :now "
+                      "ORDER BY due LIMIT 1", {'user_id': 0, 'now': 0.0}),
+    ('add_word', "SELECT id FROM user_words WHERE user_id = :user_id AND word_id = :word_id LIMIT 1",
+     {'user_id': 0, 'word_id': 0}),
+    ('increment_count', "UPDATE user_words SET count = count + 1 WHERE user_id = :user_id AND word_id = :word_id",
+     {'user_id': 0, 'word_id': 0}),
+    ('del_word', "DELETE FROM user_words WHERE user_id = :user_id AND word_id = :word_id",
+     {'user_id': 0, 'word_id': 0}),
+]
+
+def _is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+# Удаляем индекс, оставшийся недостроенным после прерванного CREATE INDEX CONCURRENTLY
+def _drop_invalid_index(connection, name):
+    invalid = connection.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"), {'name': name}).first()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+def create_index(connection, name, table, columns, unique=False):
+    concurrently = ''
+    if _is_postgres(connection):
+        _drop_invalid_index(connection, name)
+        concurrently = 'CONCURRENTLY '
+
+    connection.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} "
+                            f"ON {table} ({', '.join(columns)})"))
+
+def _create_tables(connection):
+    Base.metadata.create_all(connection)
+
+def _add_srs_columns(connection):
+    existing = {column['name'] for column in sq.inspect(connection).get_columns('user_words')}
+    for name, definition in SRS_COLUMNS:
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE user_words ADD COLUMN {name} {definition}"))
+
+def _user_due_index(connection):
+    create_index(connection, 'ix_user_words_user_due', 'user_words', ['user_id', 'due'])
+
+# Оставляем по одной связи пользователя со словом (самую раннюю). Её счётчик становится суммой счётчиков
+# всех повторов, а состояние повторения - наибольшим из них, чтобы не потерять прогресс пользователя.
+# Слияние и удаление выполняются в одной транзакции: после сбоя между ними счётчики не сложатся дважды
+def _dedupe_user_words(connection):
+    duplicates = "d.user_id = user_words.user_id AND d.word_id = user_words.word_id"
+    with engine.begin() as transaction:
+        transaction.execute(text(
+            f'UPDATE user_words SET '
+            f'"count" = (SELECT SUM(COALESCE(d."count", 0)) FROM user_words d WHERE {duplicates}), '
+            f'reps = (SELECT MAX(d.reps) FROM user_words d WHERE {duplicates}), '
+            f'"interval" = (SELECT MAX(d."interval") FROM user_words d WHERE {duplicates}), '
+            f'ease = (SELECT MAX(d.ease) FROM user_words d WHERE {duplicates}), '
+            f'due = (SELECT MAX(d.due) FROM user_words d WHERE {duplicates}) '
+            f'WHERE id IN (SELECT MIN(id) FROM user_words GROUP BY user_id, word_id HAVING COUNT(*) > 1)'))
+        result = transaction.execute(text(
+            "DELETE FROM user_words WHERE id NOT IN (SELECT MIN(id) FROM user_words GROUP BY user_id, word_id)"))
+    return result.rowcount
+
+# Уникальный индекс (user_id, word_id) обслуживает и поиск связи, и выборку слов пользователя по user_id,
+# поэтому отдельный индекс по user_id не нужен. Пока индекс строится без блокировки, бот может успеть
+# добавить новый дубликат - тогда удаляем дубликаты ещё раз и повторяем
+def _user_word_unique_index(connection):
+    for attempt in range(UNIQUE_INDEX_ATTEMPTS):
+        removed = _dedupe_user_words(connection)
+        if removed:
+            print(f'Удалено повторяющихся связей user_words: {removed}')
+        try:
+            create_index(connection, 'ux_user_words_user_word', 'user_words', ['user_id', 'word_id'], unique=True)
+            return
+        except IntegrityError:
+            if attempt == UNIQUE_INDEX_ATTEMPTS - 1:
+                raise
+
+# Внешний ключ word_id: без индекса удаление слова из общего словаря просматривает всю user_words
+def _word_index(connection):
+    create_index(connection, 'ix_user_words_word', 'user_words', ['word_id'])
+
+# Статистика пользователей: таблица и её начальное заполнение по словарям уже зарегистрированных пользователей
+def _user_stats(connection):
+    UserStats.__table__.create(connection, checkfirst=True)
+    reconcile_user_stats()
+
+# Варианты перевода: таблица и основной перевод каждого слова общего словаря. Остальные варианты
+# появляются у слов, добавленных после миграции (у старых слов API уже не опрашивается)
+def _translations(connection):
+    Translations.__table__.create(connection, checkfirst=True)
+    connection.execute(text(
+        "INSERT INTO translations (word_id, english_word, rank) "
+        "SELECT w.id, w.english_word, 0 FROM words w "
+        "WHERE NOT EXISTS (SELECT 1 FROM translations t WHERE t.word_id = w.id AND t.english_word = w.english_word)"))
+
+# (версия, название, функция, выполнять ли в транзакции)
+MIGRATIONS = [
+    (1, 'create_tables', _create_tables, True),
+    (2, 'srs_columns', _add_srs_columns, True),
+    (3, 'user_words_user_due_index', _user_due_index, False),
+    (4, 'user_words_unique_link', _user_word_unique_index, False),
+    (5, 'user_words_word_index', _word_index, False),
+    (6, 'user_stats', _user_stats, False),
+    (7, 'translations', _translations, True),
+]
+
+def _ensure_migrations_table(connection):
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+                            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, "
+                            "applied_at DOUBLE PRECISION NOT NULL)"))
+
+def _record(connection, version, name):
+    connection.execute(text(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) "
+                            "VALUES (:version, :name, :applied_at)"),
+                       {'version': version, 'name': name, 'applied_at': time.time()})
+
+def applied_migrations():
+    if not sq.inspect(engine).has_table(MIGRATIONS_TABLE):
+        return set()
+    with engine.connect() as connection:
+        return {row.version for row in connection.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+def pending_migrations():
+    try:
+        applied = applied_migrations()
+    except Exception as e:
+        print(f'Ошибка {e}')
+        return []
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def migrate():
+    applied_now = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        postgres = _is_postgres(connection)
+        if postgres:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MIGRATION_LOCK_ID})
+        try:
+            _ensure_migrations_table(connection)
+            # Список применённых версий читаем под блокировкой: другой экземпляр мог закончить миграцию
+            applied = {row.version for row in connection.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+            for version, name, func, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                print(f'Миграция {version}: {name}...')
+                if transactional:
+                    with engine.begin() as transaction:
+                        func(transaction)
+                        _record(transaction, version, name)
+                else:
+                    func(connection)
+                    _record(connection, version, name)
+                applied_now.append(version)
+        finally:
+            if postgres:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_ID})
+    return applied_now
+
+# Индексы и уникальные ограничения моделей, которых нет в БД: (таблица, колонки, уникальный ли)
+def _missing_indexes(inspector):
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append((table.name, (), False))
+            continue
+
+        # Ограничения UNIQUE в определении колонки SQLite хранит как автоматические индексы
+        options = {'include_auto_indexes': True} if inspector.dialect.name == 'sqlite' else {}
+        existing = {tuple(index['column_names']): bool(index['unique'])
+                    for index in inspector.get_indexes(table.name, **options)}
+        for constraint in inspector.get_unique_constraints(table.name):
+            existing[tuple(constraint['column_names'])] = True
+
+        expected = [(tuple(column.name for column in index.columns), bool(index.unique)) for index in table.indexes]
+        expected += [(tuple(column.name for column in constraint.columns), True) for constraint in table.constraints
+                     if isinstance(constraint, sq.UniqueConstraint)]
+        for columns, unique in expected:
+            if columns not in existing or (unique and not existing[columns]):
+                missing.append((table.name, columns, unique))
+    return missing
+
+def _invalid_indexes(connection):
+    if not _is_postgres(connection):
+        return []
+    rows = connection.execute(text("SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                                   "WHERE NOT i.indisvalid"))
+    return [row.relname for row in rows]
+
+# План запроса без выполнения; полный просмотр таблицы - признак отсутствующего индекса
+def _explain(connection, statement, parameters):
+    if _is_postgres(connection):
+        rows = connection.execute(text('EXPLAIN ' + statement), parameters).fetchall()
+        plan = '\n'.join(row[0] for row in rows)
+        slow = 'Seq Scan' in plan
+    else:
+        rows = connection.execute(text('EXPLAIN QUERY PLAN ' + statement), parameters).fetchall()
+        plan = '\n'.join(str(row[-1]) for row in rows)
+        slow = any(line.startswith('SCAN ') and 'USING' not in line for line in plan.splitlines())
+    return plan, slow
+
+def verify():
+    problems = []
+
+    pending = pending_migrations()
+    for version, name, _, _ in pending:
+        problems.append(f'Миграция {version} ({name}) не применена')
+
+    for table, columns, unique in _missing_indexes(sq.inspect(engine)):
+        if not columns:
+            problems.append(f'Нет таблицы {table}')
+        else:
+            problems.append(f"Нет {'уникального ' if unique else ''}индекса {table} ({', '.join(columns)})")
+
+    with engine.connect() as connection:
+        for name in _invalid_indexes(connection):
+            problems.append(f'Индекс {name} недостроен (INVALID)')
+
+        if _is_postgres(connection):
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, statement, parameters in KNOWN_QUERIES:
+            try:
+                plan, slow = _explain(connection, statement, parameters)
+            except Exception as e:
+                problems.append(f'{name}: не удалось построить план ({e})')
+                continue
+            if slow:
+                problems.append(f'{name}: полный просмотр таблицы\n    ' + plan.replace('\n', '\n    '))
+        connection.rollback()
+
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы БД бота')
+    parser.add_argument('command', choices=['upgrade', 'status', 'verify', 'reconcile'],
+                        help='upgrade - применить миграции, status - список неприменённых, verify - проверка схемы, '
+                             'reconcile - пересчитать статистику пользователей')
+    args = parser.parse_args()
+
+    if args.command == 'upgrade':
+        applied = migrate()
+        print(f'Применено миграций: {len(applied)}')
+    elif args.command == 'status':
+        pending = pending_migrations()
+        for version, name, _, _ in pending:
+            print(f'{version}: {name}')
+        print(f'Не применено миграций: {len(pending)}')
+    elif args.command == 'reconcile':
+        result = reconcile_user_stats()
+        print(f"Создано записей статистики: {result['created']}, исправлено: {result['fixed']}")
+    else:
+        problems = verify()
+        for problem in problems:
+            print(problem)
+        print('Схема в порядке' if not problems else f'Найдено проблем: {len(problems)}')
+        sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from dispatch_config import DISPATCH_SHARDS
+
+"""
+Предварительная подготовка (prefetch) следующего шага диалога для каждого чата.
+
+Пока пользователь думает над текущим вопросом, в фоне готовится следующий (слово, перевод, варианты
+ответа и клавиатура). Задания одного чата выполняются по очереди в одном потоке из PREFETCH_WORKERS
+(поток выбирается по id чата, как шард в dispatch_config), задания разных чатов - параллельно.
+Потоков столько же, сколько шардов диспетчера: каждый шард может поставить задание одновременно с другими.
+
+Для каждого чата хранится только последний результат. Новое задание или invalidate(cid) отменяют
+результат ещё не завершённого задания: он будет отброшен, а не сохранён. Результат старше PREFETCH_TTL
+не выдаётся: за это время словарь мог изменить другой экземпляр бота. Если задание чата уже выполняется
+(пользователь ответил быстрее, чем готовился вопрос), take ждёт его не дольше PREFETCH_WAIT секунд:
+задание уже выполнило часть работы, и повторять её в обработчике дольше. Задание, которое ещё стоит
+в очереди за заданиями других чатов, take отменяет: обработчик быстрее выполнит работу сам. Отложенную
+часть отменённого задания (fallback, например запись ответа) take выполняет сразу в текущем потоке.
+Так же invalidate отменяет ещё не начатое задание, результат которого всё равно был бы отброшен.
+
+Задание выполняется в копии контекста (contextvars) обновления, которое его поставило: учёт, привязанный
+к обновлению (например, подсчёт запросов в bench_config), видит и запросы его фонового задания.
+
+Основные функции:
+- schedule(cid, func, *args, fallback=None): Ставит в очередь чата фоновое задание, результат которого выдаст take(cid).
+- take(cid, timeout=PREFETCH_WAIT): Забирает готовый результат (дождавшись выполняемого задания) или возвращает None.
+- invalidate(cid): Отбрасывает готовый и ожидаемый результат чата (например, после изменения словаря).
+- join(): Ждёт выполнения всех поставленных заданий.
+- prefetch_stats(): Возвращает счётчики попаданий, промахов и отброшенных результатов.
+"""
+
+PREFETCH_ENABLED = True
+PREFETCH_WORKERS = DISPATCH_SHARDS
+PREFETCH_TTL = 300
+PREFETCH_WAIT = 1.0
+PREFETCH_MAX_CHATS = 10000
+
+_lock = threading.Lock()
+_executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'prefetch-{i}') for i in range(PREFETCH_WORKERS)]
+_tickets = itertools.count(1)
+# cid -> (номер, future, fallback) последнего задания, результат которого ещё ждём
+_pending = {}
+# cid -> (результат, время подготовки)
+_ready = OrderedDict()
+
+stats = {
+    'scheduled': 0,
+    'hits': 0,
+    'waited': 0,
+    'misses': 0,
+    'cancelled': 0,
+    'expired': 0,
+    'discarded': 0,
+    'failed': 0,
+}
+
+def _run(cid, ticket, func, args):
+    try:
+        value = func(*args)
+    except Exception as e:
+        value = None
+        print(f'Ошибка {e}')
+        with _lock:
+            stats['failed'] += 1
+
+    with _lock:
+        # Пока задание выполнялось, чат получил новое задание или его словарь изменился
+        if _pending.get(cid, (None,))[0] != ticket:
+            stats['discarded'] += 1
+            return
+        del _pending[cid]
+
+        if value is None:
+            return
+        _ready[cid] = (value, time.monotonic())
+        _ready.move_to_end(cid)
+        while len(_ready) > PREFETCH_MAX_CHATS:
+            _ready.popitem(last=False)
+
+def schedule(cid, func, *args, fallback=None):
+    if not PREFETCH_ENABLED:
+        return
+
+    with _lock:
+        ticket = next(_tickets)
+        _ready.pop(cid, None)
+        stats['scheduled'] += 1
+        # Задание не сравнит номер раньше, чем мы его запишем: для этого ему нужна та же блокировка
+        context = contextvars.copy_context()
+        future = _executors[hash(cid) % len(_executors)].submit(context.run, _run, cid, ticket, func, args)
+        _pending[cid] = (ticket, future, fallback)
+
+# Отменяем задание, которое ещё не началось, и выполняем его отложенную часть в текущем потоке
+def _cancel(cid, pending):
+    ticket, future, fallback = pending
+    if not future.cancel():
+        return False
+
+    with _lock:
+        if _pending.get(cid, (None,))[0] == ticket:
+            del _pending[cid]
+        stats['cancelled'] += 1
+    if fallback is not None:
+        fallback()
+    return True
+
+def take(cid, timeout=PREFETCH_WAIT):
+    if not PREFETCH_ENABLED:
+        return None
+
+    with _lock:
+        item = _ready.pop(cid, None)
+        pending = _pending.get(cid)
+
+    if item is None and pending is not None:
+        # Задание ещё в очереди: отменяем его, вопрос подберёт обработчик
+        if not _cancel(cid, pending) and timeout:
+            wait([pending[1]], timeout)
+        with _lock:
+            item = _ready.pop(cid, None)
+            if item is not None:
+                stats['waited'] += 1
+
+    with _lock:
+        if item is None:
+            stats['misses'] += 1
+            return None
+
+        value, prepared_at = item
+        if time.monotonic() - prepared_at >= PREFETCH_TTL:
+            stats['expired'] += 1
+            return None
+
+        stats['hits'] += 1
+        return value
+
+def invalidate(cid):
+    with _lock:
+        pending = _pending.pop(cid, None)
+        _ready.pop(cid, None)
+
+    # Результат ещё не начатого задания всё равно был бы отброшен
+    if pending is not None:
+        _cancel(cid, pending)
+
+# Потоки заданий выполняют их по порядку, поэтому пустое задание в каждом потоке завершится последним
+def join():
+    wait([executor.submit(lambda: None) for executor in _executors])
+
+def prefetch_stats():
+    with _lock:
+        result = dict(stats)
+        result['ready'] = len(_ready)
+        result['pending'] = len(_pending)
+    return result
@@ -1,25 +1,50 @@
-import random
-import json
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
 
 import sqlalchemy as sq
 from sqlalchemy import text
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, scoped_session
 
 from common_config import load_data_from_file
-from YAD_config import translate
-from log_config import logger
+from YAD_config import translate_variants
+from log_config import log_event
+from metrics_config import timed
+from trace_config import register_engine
+from distractor_config import pick_distractors
+from cache_config import (VOCAB_REFRESH_POLICY, load_vocabulary, add_to_vocabulary, get_translation,
+                          vocabulary_needs_check, mark_vocabulary_checked,
+                          vocabulary_version, get_word, get_word_id, accepted_answers, load_user_index, get_user_index,
+                          add_to_user_index, remove_from_user_index, random_user_word_id)
 
 """
 Основные функции:
-- create_tables(engine): Создает необходимые таблицы в базе данных.
+- unit_of_work(func): Декоратор: выполняет функцию в сессии текущего потока и освобождает её по завершении.
+- create_tables(engine): Создает необходимые таблицы в базе данных (для существующей БД - migrate_config).
 - insert_data(data): Заполняет базу данных русским словарем с переводами.
+- existing_russian_words(words): Возвращает слова из переданных, которые уже есть в общем словаре.
+- insert_words_batch(pairs, variants=None): Пакетно добавляет пары (русское слово, перевод) и все варианты перевода в общий словарь.
+- words_by_russian(words): Возвращает id и переводы слов общего словаря одним запросом по набору слов.
+- attach_user_words(cid, word_ids): Пакетно добавляет слова в персональный словарь пользователя.
+- refresh_vocabulary(force=False): Синхронизирует кэш общего словаря с базой данных.
 - add_user(cid, user_name=None): Регистрирует нового пользователя и создает начальный набор слов.
-- random_target_word(cid): Возвращает случайное слово из словаря пользователя.
-- translate_target_word(target_word): Возвращает перевод заданного слова из базы данных.
-- other_words(): Возвращает три случайных слова для составления альтернативных вариантов перевода.
+- random_target(cid, exclude_word_id=None): Возвращает слово для вопроса (сначала подлежащее повторению) вместе с id пользователя и id слова.
+- other_words(correct_word, word_id=None): Возвращает три похожих слова (не из допустимых ответов) для альтернативных вариантов перевода.
 - add_word(cid, word): Добавляет слово в персональный словарь пользователя.
-- del_word(cid, word): Удаляет слово из персонального словаря пользователя.
+- find_word(russian_word): Возвращает id и перевод слова общего словаря (из кэша, при промахе - из БД).
+- del_word(cid, word): Удаляет слово из персонального словаря пользователя, возвращает (успех, перевод).
+- get_user(cid): Возвращает пользователя по telegram_id.
 - get_user_word_count(cid): Возвращает количество слов в словаре пользователя.
+- increment_count(user_id, word_id): Атомарно увеличивает счетчик правильных ответов и переносит срок повторения.
+- record_wrong_answer(user_id, word_id): Возвращает слово на повторное изучение после ошибки.
+- postpone_word(user_id, word_id): Откладывает пропущенное кнопкой "Дальше" слово на SRS_SKIP_DELAY секунд.
+- next_due_word(user_id, exclude_word_id=None): Возвращает id слова, которое пора повторить.
+- flush_answers(): Сбрасывает в БД ответы, накопленные в режиме отложенной записи.
+- get_user_stats(cid): Возвращает статистику пользователя одним чтением по первичному ключу.
+- reconcile_user_stats(batch_size=RECONCILE_BATCH_SIZE): Пересчитывает статистику пользователей по таблицам словаря.
 """
 
 Base = declarative_base()
@@ -29,17 +54,62 @@ base_name = 'ImLearningEnglish'
 encoding ='utf-8'
 
 DSN = "postgresql://postgres:" + password + "@localhost:5432/" + base_name + "?client_encoding=" + encoding
-engine = sq.create_engine(DSN)
+# Строку подключения можно переопределить переменной окружения (например, бенчмарк на отдельной БД или SQLite)
+DSN = os.environ.get('BOT_DSN') or DSN
+# Параметры пула соединений: каждый поток-обработчик получает своё соединение
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+POOL_TIMEOUT = 30
+POOL_RECYCLE = 1800
+POOL_PRE_PING = True
+
+engine = sq.create_engine(DSN, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT,
+                          pool_recycle=POOL_RECYCLE, pool_pre_ping=POOL_PRE_PING)
+register_engine(engine)
+
+# Сессия привязана к потоку: обработчики разных обновлений не делят одну сессию и одно соединение
+Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+session = Session
+
+_uow = threading.local()
+
+# Единица работы: сессия живёт до выхода из самого внешнего вызова и затем возвращает соединение в пул
+def unit_of_work(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_uow, 'depth', 0)
+        _uow.depth = depth + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _uow.depth = depth
+            if depth == 0:
+                Session.remove()
+    return wrapper
 
-Session = sessionmaker(bind=engine)
-session = Session()
+# Длина слова в таблице words: более длинное слово PostgreSQL отвергнет вместе со всем пакетом вставки
+WORD_MAX_LENGTH = 40
 
 class Words(Base):
     __tablename__ = "words"
 
     id = sq.Column(sq.Integer, primary_key=True)
-    russian_word = sq.Column(sq.String(length=40), unique=True)
-    english_word = sq.Column(sq.String(length=40))
+    russian_word = sq.Column(sq.String(length=WORD_MAX_LENGTH), unique=True)
+    english_word = sq.Column(sq.String(length=WORD_MAX_LENGTH))
+
+# Все варианты перевода слова из ответа словаря (основной - rank 0) для проверки ответов
+class Translations(Base):
+    __tablename__ = "translations"
+
+    id = sq.Column(sq.Integer, primary_key=True)
+    word_id = sq.Column(sq.Integer, sq.ForeignKey('words.id'), nullable=False)
+    english_word = sq.Column(sq.String(length=100), nullable=False)
+    pos = sq.Column(sq.String(length=20))
+    rank = sq.Column(sq.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        sq.Index('ux_translations_word_english', 'word_id', 'english_word', unique=True),
+    )
 
 class Users(Base):
     __tablename__ = "users"
@@ -55,9 +125,48 @@ class UserWords(Base):
     word_id = sq.Column(sq.Integer, sq.ForeignKey('words.id'))
     count = sq.Column(sq.Integer, default=0, nullable=False)
 
+    # Интервальное повторение: время следующего показа (unix time), коэффициент лёгкости,
+    # текущий интервал в днях и число правильных ответов подряд
+    due = sq.Column(sq.Float, default=0, nullable=False)
+    ease = sq.Column(sq.Float, default=2.5, nullable=False)
+    interval = sq.Column(sq.Float, default=0, nullable=False)
+    reps = sq.Column(sq.Integer, default=0, nullable=False)
+
     user = relationship("Users")
     word = relationship("Words")
 
+    # Индексы добавляются в существующую БД миграциями migrate_config
+    __table_args__ = (
+        sq.Index('ux_user_words_user_word', 'user_id', 'word_id', unique=True),
+        sq.Index('ix_user_words_user_due', 'user_id', 'due'),
+        sq.Index('ix_user_words_word', 'word_id'),
+    )
+
+# Статистика пользователя, которая обновляется в тех же транзакциях, что и его словарь и ответы:
+# слов в словаре, выученных слов (MASTERED_REPS правильных ответов подряд), ответов, дней занятий подряд
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = sq.Column(sq.Integer, sq.ForeignKey('users.id'), primary_key=True)
+    total_words = sq.Column(sq.Integer, default=0, nullable=False)
+    mastered_words = sq.Column(sq.Integer, default=0, nullable=False)
+    correct_answers = sq.Column(sq.Integer, default=0, nullable=False)
+    wrong_answers = sq.Column(sq.Integer, default=0, nullable=False)
+    streak = sq.Column(sq.Integer, default=0, nullable=False)
+    best_streak = sq.Column(sq.Integer, default=0, nullable=False)
+    # Время последнего ответа (unix time) и номер его дня (UTC) для подсчёта дней подряд
+    last_active = sq.Column(sq.Float)
+    last_active_day = sq.Column(sq.Integer)
+
+# Состояние диалога с пользователем (текущий вопрос, ожидаемый шаг) для бэкенда 'postgres' в state_config
+class QuizState(Base):
+    __tablename__ = "quiz_state"
+
+    kind = sq.Column(sq.String(length=16), primary_key=True)
+    chat_id = sq.Column(sq.BIGINT, primary_key=True)
+    data = sq.Column(sq.Text, nullable=False)
+    updated_at = sq.Column(sq.Float, nullable=False)
+
  # База русских слов
 russian_words = [
     "абрикос", "аппарат", "астра", "аквариум", "барсук", "банан", "баран", "борщ", "варенье", "виноград", "весна",
@@ -106,34 +215,192 @@ def truncate_all_tables(session, Base):
         session.rollback()
         print(f'Ошибка {e}')
 
-# Наполняем БД русскими словами с переводом (запрос на Yandex.Dictionary)
+# Наполняем БД русскими словами с переводом (запрос на Yandex.Dictionary).
+# Существующие слова и прогресс пользователей не затрагиваются, см. seed_config.
 def insert_data(data):
-    truncate_all_tables(session, Base)
+    from seed_config import seed_words
+    return seed_words(data, source='russian_words')
+
+# Конструктор INSERT с поддержкой ON CONFLICT для диалекта текущего движка
+def dialect_insert(model):
+    if engine.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
+
+# INSERT ... ON CONFLICT DO NOTHING для диалекта текущего движка
+def insert_ignore(model):
+    return dialect_insert(model).on_conflict_do_nothing()
+
+# Строки таблицы translations для слова: варианты без повторов, не длиннее колонки; основной перевод - первый
+def translation_rows(word_id, english_word, variants=None):
+    rows = []
+    seen = set()
+    for text_value, pos in [(english_word, None)] + list(variants or []):
+        text_value = text_value.strip().lower()
+        if text_value and text_value not in seen and len(text_value) <= 100:
+            seen.add(text_value)
+            rows.append({'word_id': word_id, 'english_word': text_value, 'pos': pos, 'rank': len(rows)})
+    # Часть речи основного перевода берём из ответа словаря
+    if variants and rows and rows[0]['pos'] is None:
+        rows[0]['pos'] = dict((text_value.strip().lower(), pos) for text_value, pos in variants).get(rows[0]['english_word'])
+    return rows
+
+# Возвращаем множество русских слов из переданных, которые уже есть в общем словаре (один запрос)
+@timed('db')
+@unit_of_work
+def existing_russian_words(words):
+    with session.no_autoflush:
+        try:
+            rows = session.query(Words.russian_word).filter(Words.russian_word.in_(list(words))).all()
+            return {row.russian_word for row in rows}
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+            raise
+
+# Пакетно добавляем слова в общий словарь одним INSERT ... ON CONFLICT DO NOTHING, а их варианты
+# перевода (variants: русское слово -> [(перевод, часть речи), ...]) - вторым пакетным INSERT
+@timed('db')
+@unit_of_work
+def insert_words_batch(pairs, variants=None):
+    if not pairs:
+        return 0
+
+    try:
+        rows = [{'russian_word': russian_word, 'english_word': english_word} for russian_word, english_word in pairs]
+        # RETURNING возвращает только вставленные слова: уже существующие сохраняют свои варианты
+        inserted = session.execute(insert_ignore(Words).values(rows).returning(
+            Words.id, Words.russian_word, Words.english_word)).all()
+
+        translations = []
+        for row in inserted:
+            translations.extend(translation_rows(row.id, row.english_word, (variants or {}).get(row.russian_word)))
+        if translations:
+            session.execute(insert_ignore(Translations), translations)
+        session.commit()
 
+        for row in inserted:
+            add_to_vocabulary(row.id, row.russian_word, row.english_word,
+                              [variant for variant, _ in (variants or {}).get(row.russian_word, ())])
+        return len(inserted)
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
+        raise
+
+# Добавляем в кэш слова, найденные в БД мимо кэша (их вставил другой процесс), вместе с вариантами перевода:
+# без них допустимым ответом считался бы только основной перевод до полной перезагрузки словаря
+def cache_found_words(rows):
+    missing = [row for row in rows if get_word(row.id) is None]
+    if not missing:
+        return
+
+    variants = {}
+    for word_id, english_word in session.query(Translations.word_id, Translations.english_word).filter(
+            Translations.word_id.in_([row.id for row in missing])):
+        variants.setdefault(word_id, []).append(english_word)
+    for row in missing:
+        add_to_vocabulary(row.id, row.russian_word, row.english_word, variants.get(row.id))
+
+# Получаем слова общего словаря одним запросом по набору русских слов: русское слово -> (id, перевод)
+@timed('db')
+@unit_of_work
+def words_by_russian(words):
     with session.no_autoflush:
         try:
-            for word in data:
-                existing_word = session.query(Words).filter_by(russian_word=word.lower()).first()
+            rows = session.query(Words.id, Words.russian_word, Words.english_word).filter(
+                Words.russian_word.in_(list(words))).all()
+            # Слова, добавленные другими процессами, сразу попадают в кэш
+            cache_found_words(rows)
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+            raise
 
-                if not existing_word:
-                    translated_word = translate(word)
+    return {row.russian_word: (row.id, row.english_word) for row in rows}
 
-                    if translated_word is not None:
-                        new_word = Words(russian_word=word.lower(), english_word=translated_word.lower())
-                        session.add(new_word)
-                        print(f'Слово "{word.title()} / {translated_word.title()}" успешно добавлено в базу данных')
-                    else:
-                        print(f'Перевод для слова "{word.title()}" не найден, пропускаем...')
+# Пакетно связываем пользователя со словами, которых ещё нет в его словаре. Возвращаем число добавленных слов
+@timed('db')
+@unit_of_work
+def attach_user_words(cid, word_ids):
+    entry = user_word_index(cid)
+    if entry is None:
+        return 0
 
-            session.commit()
+    word_ids = list(dict.fromkeys(word_ids))
+    if not word_ids:
+        return 0
+
+    with session.no_autoflush:
+        try:
+            linked = session.query(UserWords.word_id).filter(UserWords.user_id == entry['user_id'],
+                                                             UserWords.word_id.in_(word_ids)).all()
+            linked = {row.word_id for row in linked}
+            new_ids = [word_id for word_id in word_ids if word_id not in linked]
+
+            if new_ids:
+                session.execute(sq.insert(UserWords), [{'user_id': entry['user_id'], 'word_id': word_id}
+                                                       for word_id in new_ids])
+                update_stats(entry['user_id'], total_words=UserStats.total_words + len(new_ids))
+                session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+            raise
+
+    for word_id in new_ids:
+        add_to_user_index(cid, word_id)
+    return len(new_ids)
 
-            print(f'Всего в базе: {session.query(Words).count()} русских слов')
+# Синхронизируем кэш общего словаря с БД согласно политике обновления
+@timed('db')
+@unit_of_work
+def refresh_vocabulary(force=False):
+    if not force and not vocabulary_needs_check():
+        return
 
+    with session.no_autoflush:
+        try:
+            if not force and VOCAB_REFRESH_POLICY == 'version' and vocabulary_version() is not None:
+                # Дешёвая проверка: перечитываем словарь, только если другой процесс его изменил
+                count, max_id = session.query(sq.func.count(Words.id), sq.func.max(Words.id)).one()
+                if (count, max_id) == vocabulary_version():
+                    mark_vocabulary_checked()
+                    return
+
+            rows = session.query(Words.id, Words.russian_word, Words.english_word).all()
+            translations = session.query(Translations.word_id, Translations.english_word).all()
+            load_vocabulary(rows, translations)
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
 
+# Стартовый набор слов нового пользователя: размер и правило отбора
+# - 'first': слова в порядке добавления в общий словарь (встроенный список russian_words)
+# - 'shortest': сначала самые короткие слова (упрощённая оценка уровня сложности)
+# - 'random': случайные слова
+STARTER_SET_SIZE = 111
+STARTER_SET_RULE = 'first'
+
+# Формируем INSERT ... SELECT, связывающий пользователя со стартовым набором слов
+def starter_words_insert(user_id):
+    order_by = {
+        'first': [Words.id],
+        'shortest': [sq.func.length(Words.russian_word), Words.id],
+        'random': [sq.func.random()],
+    }[STARTER_SET_RULE]
+
+    starter_words = sq.select(sq.literal(user_id), Words.id).order_by(*order_by)
+    if STARTER_SET_SIZE is not None:
+        starter_words = starter_words.limit(STARTER_SET_SIZE)
+
+    return sq.insert(UserWords).from_select(['user_id', 'word_id'], starter_words)
+
 # Создаем user и наполняем персональную базу стандартным набором слов
+@timed('db')
+@unit_of_work
 def add_user(cid, user_name = ''):
     with session.no_autoflush:
         try:
@@ -148,28 +415,16 @@ def add_user(cid, user_name = ''):
             session.add(new_user)
             session.flush()
 
-            add_words = session.query(Words).order_by(Words.id).limit(111).all()
-            for word in add_words:
-                user_words = UserWords(user_id=new_user.id, word_id=word.id)
-                session.add(user_words)
-
+            # Стартовый набор слов добавляем одним INSERT ... SELECT на стороне БД; RETURNING сразу даёт
+            # id слов для индекса пользователя, поэтому первый вопрос не перечитывает их из БД
+            word_ids = session.execute(starter_words_insert(new_user.id).returning(UserWords.word_id)).scalars().all()
+            words_added = len(word_ids)
+            session.add(UserStats(user_id=new_user.id, total_words=words_added))
             session.commit()
+            load_user_index(cid, new_user.id, word_ids)
 
-            # Подготавливаем данные для логирования
-            details = {
-                'RESULT': 'created',
-                'USER': cid,
-                'WORDS_ADDED': len(add_words),
-            }
-
-            # Формируем финальную лог-запись
-            log_entry = {
-                'ACTION': 'create_user',
-                'DETAILS': details,
-            }
-
-            # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-            logger.info(json.dumps(log_entry, ensure_ascii=False))
+            # Записываем событие в журнал
+            log_event('create_user', RESULT='created', USER=cid, WORDS_ADDED=words_added)
 
             # print(f"Пользователь '{cid.lower()}' успешно добавлен в систему!")
             return new_user
@@ -178,8 +433,14 @@ def add_user(cid, user_name = ''):
             session.rollback()
             print(f'Ошибка {e}')
 
-# Получаем из персонального словаря пользователя случайное русское слово
-def random_target_word(cid):
+# Получаем индекс слов пользователя (из кэша, при промахе - одним проходом по БД)
+@timed('db')
+@unit_of_work
+def user_word_index(cid):
+    entry = get_user_index(cid)
+    if entry is not None:
+        return entry
+
     with session.no_autoflush:
         try:
             # Получаем пользователя по telegram_id
@@ -188,137 +449,126 @@ def random_target_word(cid):
                 print(f"Пользователь с tg_id={cid} не найден.")
                 return None
 
-            # Получаем все слова, принадлежащие данному пользователю
-            user_words_query = session.query(Words.russian_word) \
-                .join(UserWords, Words.id == UserWords.word_id) \
-                .filter(UserWords.user_id == user.id) \
-                .all()
-
-            # Преобразуем результат в список слов
-            user_words = [word.russian_word for word in user_words_query]
-
-            # Выбираем случайное слово из списка
-            if user_words:
-                random_word = random.choice(user_words)
-                return random_word
-            else:
-                print(f"Нет слов в словаре пользователя {cid}")
-                return None
-        except Exception as e:
-            session.rollback()
-            print(f'Ошибка {e}')
+            # Получаем id всех слов, принадлежащих данному пользователю
+            word_ids = session.query(UserWords.word_id).filter(UserWords.user_id == user.id).all()
 
-# Получаем из БД перевод русского слова
-def translate_target_word(target_word):
-    with session.no_autoflush:
-        try:
-            # Попробуем найти перевод слова
-            translation = session.query(Words).filter_by(russian_word=target_word).first()
-
-            if translation is None:
-                # Нет подходящего слова в базе данных
-                print(f"Не удалось найти перевод для слова '{target_word.title()}'")
-                return None
-
-            return translation.english_word
+            return load_user_index(cid, user.id, [row.word_id for row in word_ids])
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
 
-# Формируем список из 3 случайных слов
-def other_words():
+# Получаем из персонального словаря пользователя слово для вопроса: id пользователя, id слова, слово и перевод
+@timed('db')
+def random_target(cid, exclude_word_id=None):
+    entry = user_word_index(cid)
+    if entry is None:
+        return None
+
+    # Сначала слово, которое пора повторить; если таких нет - случайное слово для тренировки
+    # (не то, что только что показано, если в словаре есть другие)
+    word_id = next_due_word(entry['user_id'], exclude_word_id)
+    if word_id is None:
+        word_id = random_user_word_id(entry, exclude_word_id)
+    if word_id is None:
+        print(f"Нет слов в словаре пользователя {cid}")
+        return None
+
+    refresh_vocabulary()
+    word = get_word(word_id)
+    if word is None:
+        # Слово добавлено другим процессом и ещё не попало в кэш
+        refresh_vocabulary(force=True)
+        word = get_word(word_id)
+        if word is None:
+            return None
+
+    return {
+        'user_id': entry['user_id'],
+        'word_id': word_id,
+        'target_word': word[0],
+        'translated_word': word[1],
+    }
+
+# Формируем список из 3 неправильных вариантов, похожих на правильный ответ (без обращения к БД).
+# Синонимы правильного ответа в варианты не попадают: иначе верных кнопок было бы несколько
+@timed('db')
+def other_words(correct_word, word_id=None):
+    refresh_vocabulary()
+    accepted = accepted_answers(word_id) if word_id is not None else None
+    return pick_distractors(correct_word, 3, exclude=accepted or ())
+
+# Ищем слово общего словаря по русской форме: сначала в кэше, при промахе - в БД. Возвращаем (id слова, перевод)
+@timed('db')
+@unit_of_work
+def find_word(russian_word):
+    refresh_vocabulary()
+
+    word_id = get_word_id(russian_word)
+    if word_id is not None:
+        return word_id, get_translation(russian_word)
+
     with session.no_autoflush:
         try:
-            all_words = session.query(Words.english_word).all()
-            all_words = [word.english_word for word in all_words]
-            other_random_words = random.sample(all_words, 3)
+            word = session.query(Words.id, Words.russian_word, Words.english_word).filter_by(
+                russian_word=russian_word).first()
+            if word is None:
+                return None
 
-            return other_random_words
+            cache_found_words([word])
+            return word.id, word.english_word
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
 
 # Функция добавления слова в персональный словарь пользователя
+@timed('db')
+@unit_of_work
 def add_word(cid, word):
     with session.no_autoflush:
         try:
-            # Получаем пользователя по telegram_id
-            user = session.query(Users).filter_by(telegram_id=cid).first()
-            if not user:
+            # Пользователя берём из индекса его слов: индекс всё равно нужен для следующего вопроса
+            entry = user_word_index(cid)
+            if entry is None:
                 # print(f"Пользователь с tg_id={cid} не найден.")
                 return False, None
 
-            # Проверяем, есть ли это слово уже в таблице Words (русская версия)
-            existing_word = session.query(Words).filter_by(russian_word=word.lower()).first()
-            translated_word = translate(word)
+            # Проверяем, есть ли это слово уже в общем словаре (русская версия)
+            existing_word = find_word(word.lower())
 
             if existing_word:
+                # Перевод уже есть в БД, к API не обращаемся
+                word_id, translated_word = existing_word
+
                 # Проверяем, связано ли уже существующее слово с данным пользователем
-                existing_user_word = session.query(UserWords).filter_by(user_id=user.id, word_id=existing_word.id).first()
+                existing_user_word = session.query(UserWords.id).filter_by(user_id=entry['user_id'], word_id=word_id).first()
                 if existing_user_word:
 
-                    # Подготавливаем данные для логирования
-                    details = {
-                        'RESULT': 'already_exists',
-                        'USER': cid,
-                        'WORD': word.title(),
-                    }
-
-                    # Формируем финальную лог-запись
-                    log_entry = {
-                        'ACTION': 'add_word',
-                        'DETAILS': details,
-                    }
-
-                    # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-                    logger.info(json.dumps(log_entry, ensure_ascii=False))
+                    # Записываем событие в журнал
+                    log_event('add_word', RESULT='already_exists', USER=cid, WORD=word.title())
 
                     # print(f"Слово '{word.title()}' уже присутствует в словаре пользователя: {cid}.")
                     return False, translated_word
 
                 # Если слово есть в общем словаре, но не у текущего пользователя, добавляем связь
-                user_word = UserWords(user_id=user.id, word_id=existing_word.id)
+                user_word = UserWords(user_id=entry['user_id'], word_id=word_id)
                 session.add(user_word)
+                update_stats(entry['user_id'], total_words=UserStats.total_words + 1)
                 session.commit()
+                add_to_user_index(cid, word_id)
 
-                # Подготавливаем данные для логирования
-                details = {
-                    'RESULT': 'added_existing',
-                    'USER': cid,
-                    'WORD': word.title(),
-                }
-
-                # Формируем финальную лог-запись
-                log_entry = {
-                    'ACTION': 'add_word',
-                    'DETAILS': details,
-                }
+                # Записываем событие в журнал
+                log_event('add_word', RESULT='added_existing', USER=cid, WORD=word.title())
 
-                # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-                logger.info(json.dumps(log_entry, ensure_ascii=False))
-
-                # print(f"Слово '{word.title()} / {existing_word.english_word.title()}' успешно добавлено в словарь пользователя: {cid}.")
+                # print(f"Слово '{word.title()} / {translated_word.title()}' успешно добавлено в словарь пользователя: {cid}.")
                 return True, translated_word
 
-            # Если слово не найдено, добавляем его в Words и подключаем к пользователю
+            # Если слово не найдено, добавляем его в Words со всеми вариантами перевода и подключаем к пользователю
+            variants = translate_variants(word)
+            translated_word = variants[0][0] if variants else None
             if not translated_word:
 
-                # Подготавливаем данные для логирования
-                details = {
-                    'RESULT': 'translation_failed',
-                    'USER': cid,
-                    'WORD': word.title(),
-                }
-
-                # Формируем финальную лог-запись
-                log_entry = {
-                    'ACTION': 'add_word',
-                    'DETAILS': details,
-                }
-
-                # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-                logger.warning(json.dumps(log_entry, ensure_ascii=False))
-
+                # Записываем событие в журнал
+                log_event('add_word', RESULT='translation_failed', USER=cid, WORD=word.title(), level='warning')
 
                 # print(f"Не удалось перевести слово '{word.title()}'. Попробуйте позже.")
                 return False, None
@@ -327,27 +577,19 @@ def add_word(cid, word):
             new_word = Words(russian_word=word.lower(), english_word=translated_word.lower())
             session.add(new_word)
             session.flush()  # Фиксируем временный ID для дальнейшего использования
+            session.execute(sq.insert(Translations), translation_rows(new_word.id, new_word.english_word, variants))
 
             # Создаем связь пользователя с этим словом
-            user_word = UserWords(user_id=user.id, word_id=new_word.id)
+            user_word = UserWords(user_id=entry['user_id'], word_id=new_word.id)
             session.add(user_word)
+            update_stats(entry['user_id'], total_words=UserStats.total_words + 1)
             session.commit()
+            add_to_vocabulary(new_word.id, new_word.russian_word, new_word.english_word,
+                              [variant for variant, _ in variants])
+            add_to_user_index(cid, new_word.id)
 
-            # Подготавливаем данные для логирования
-            details = {
-                'RESULT': 'added',
-                'USER': cid,
-                'WORD': word.title(),
-            }
-
-            # Формируем финальную лог-запись
-            log_entry = {
-                'ACTION': 'add_word',
-                'DETAILS': details,
-            }
-
-            # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-            logger.info(json.dumps(log_entry, ensure_ascii=False))
+            # Записываем событие в журнал
+            log_event('add_word', RESULT='added', USER=cid, WORD=word.title())
 
             # print(f"Слово '{word.title()} /  {translated_word.title()}' успешно добавлено в словарь пользователя: {cid}.")
             return True, translated_word
@@ -355,107 +597,395 @@ def add_word(cid, word):
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
+            return False, None
 
-# Функция удаления слова из персонального словаря пользователя
+# Функция удаления слова из персонального словаря пользователя. Возвращаем (удалено ли слово, перевод слова)
+@timed('db')
+@unit_of_work
 def del_word(cid, word):
     with session.no_autoflush:
         try:
-            # Получаем пользователя по telegram_id
-            user = session.query(Users).filter_by(telegram_id=cid).first()
+            # Пользователя берём из индекса его слов
+            entry = user_word_index(cid)
 
-            if not user:
+            if entry is None:
                 # print(f"Пользователь с tg_id='{cid}' не найден.")
-                return False
+                return False, None
 
-            # Поиск слова в базе данных по русской форме
-            word_to_delete = session.query(Words).filter_by(russian_word=word.lower()).first()
+            # Поиск слова в общем словаре по русской форме
+            word_to_delete = find_word(word.lower())
 
             if not word_to_delete:
 
-                # Подготавливаем данные для логирования
-                details = {
-                    'RESULT': 'word_not_found',
-                    'USER': cid,
-                    'WORD': word.title(),
-                }
+                # Записываем событие в журнал
+                log_event('delete_word', RESULT='word_not_found', USER=cid, WORD=word.title())
 
-                # Формируем финальную лог-запись
-                log_entry = {
-                    'ACTION': 'delete_word',
-                    'DETAILS': details,
-                }
+                # print(f"Слово '{word.title()}' не найдено в базе данных.")
+                return False, None
 
-                # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-                logger.info(json.dumps(log_entry, ensure_ascii=False))
+            word_id, english_word = word_to_delete
+
+            # Удаляем связь пользователя со словом одним запросом: RETURNING показывает, была ли она
+            # и было ли слово выученным
+            user_words = UserWords.__table__
+            deleted = session.execute(
+                sq.delete(user_words)
+                .where(user_words.c.user_id == entry['user_id'], user_words.c.word_id == word_id)
+                .returning(user_words.c.reps)
+            ).scalars().all()
+            if deleted:
+                update_stats(entry['user_id'], total_words=UserStats.total_words - len(deleted),
+                             mastered_words=UserStats.mastered_words - sum(reps >= MASTERED_REPS for reps in deleted))
+            session.commit()
 
-                # print(f"Слово '{word.title()}' не найдено в базе данных.")
-                return False
+            if not deleted:
 
-            # Проверяем, связана ли данная запись с указанным пользователем
-            association = session.query(UserWords).filter_by(user_id=user.id, word_id=word_to_delete.id).first()
+                # Записываем событие в журнал
+                log_event('delete_word', RESULT='not_in_user_dict', USER=cid, WORD=word.title())
 
-            if not association:
+                # print(f"Слово '{word.title()} / {english_word.title()}' не найдено в словаре пользователя: {cid}.")
+                return False, english_word
 
-                # Подготавливаем данные для логирования
-                details = {
-                    'RESULT': 'not_in_user_dict',
-                    'USER': cid,
-                    'WORD': word.title(),
-                }
+            remove_from_user_index(cid, word_id)
 
-                # Формируем финальную лог-запись
-                log_entry = {
-                    'ACTION': 'delete_word',
-                    'DETAILS': details,
-                }
+            # Записываем событие в журнал
+            log_event('delete_word', RESULT='deleted', USER=cid, WORD=word.title())
 
-                # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-                logger.info(json.dumps(log_entry, ensure_ascii=False))
+            # print(f"Слово '{word.title()} / {english_word.title()}' успешно удалено из словаря пользователя: {cid}.")
 
-                # print(f"Слово '{word.title()} / {word_to_delete.english_word.title()}' не найдено в словаре пользователя: {cid}.")
-                return False
+            return True, english_word
 
-            # Удаляем связь пользователя со словом
-            session.delete(association)
-            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+            return False, None
 
-            # Подготавливаем данные для логирования
-            details = {
-                'RESULT': 'deleted',
-                'USER': cid,
-                'WORD': word.title(),
-            }
+# Получаем пользователя по telegram_id
+@timed('db')
+@unit_of_work
+def get_user(cid):
+    with session.no_autoflush:
+        try:
+            return session.query(Users).filter_by(telegram_id=cid).first()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
 
-            # Формируем финальную лог-запись
-            log_entry = {
-                'ACTION': 'delete_word',
-                'DETAILS': details,
-            }
+# Функция для получения количества слов пользователя (из индекса его слов, при промахе индекс загружается из БД)
+@timed('db')
+def get_user_word_count(cid):
+    entry = user_word_index(cid)
+    if entry is None:
+        return 0
+    return len(entry['ids'])
+
+# Отложенная запись ответов (write-behind): события копятся в памяти и сбрасываются пакетом
+# по таймеру (ANSWER_FLUSH_INTERVAL секунд) или при накоплении ANSWER_FLUSH_SIZE событий
+WRITE_BEHIND_ENABLED = False
+ANSWER_FLUSH_INTERVAL = 5
+ANSWER_FLUSH_SIZE = 500
+
+# Правильные и неправильные ответы по ключу (user_id, word_id)
+_correct_buffer = Counter()
+_wrong_buffer = Counter()
+_answer_lock = threading.Lock()
+_flush_thread = None
+
+# Интервальное повторение (SM-2): правильный ответ увеличивает интервал до следующего показа,
+# ошибка сбрасывает слово на повторное изучение через SRS_RELEARN_DELAY секунд
+SRS_MIN_EASE = 1.3
+SRS_EASE_STEP = 0.1
+SRS_EASE_PENALTY = 0.2
+SRS_RELEARN_DELAY = 10 * 60
+SRS_SKIP_DELAY = 10 * 60
+DAY_SECONDS = 24 * 60 * 60
+
+def srs_correct_values(now):
+    columns = UserWords.__table__.c
+    new_interval = sq.case((columns.reps == 0, 1.0), (columns.reps == 1, 6.0), else_=columns.interval * columns.ease)
+    return {
+        'reps': columns.reps + 1,
+        'interval': new_interval,
+        'ease': columns.ease + SRS_EASE_STEP,
+        'due': now + new_interval * DAY_SECONDS,
+    }
+
+# Слово считается выученным после MASTERED_REPS правильных ответов подряд
+MASTERED_REPS = 3
+RECONCILE_BATCH_SIZE = 1000
+
+# Обновляем статистику пользователя в текущей транзакции
+def update_stats(user_id, **values):
+    user_stats = UserStats.__table__
+    session.execute(sq.update(user_stats).where(user_stats.c.user_id == user_id).values(**values))
+
+# Ответ продлевает серию дней занятий подряд, если предыдущий был вчера, и начинает новую, если раньше
+def stats_activity_values(now):
+    columns = UserStats.__table__.c
+    today = int(now // DAY_SECONDS)
+    streak = sq.case((columns.last_active_day == today, columns.streak),
+                     (columns.last_active_day == today - 1, columns.streak + 1), else_=1)
+    return {
+        'streak': streak,
+        'best_streak': sq.case((streak > columns.best_streak, streak), else_=columns.best_streak),
+        'last_active': now,
+        'last_active_day': today,
+    }
+
+# Подзапросы пересчёта статистики по словарю пользователя
+def words_count(user_id, mastered=False):
+    user_words = UserWords.__table__
+    query = sq.select(sq.func.count()).where(user_words.c.user_id == user_id)
+    if mastered:
+        query = query.where(user_words.c.reps >= MASTERED_REPS)
+    return query.scalar_subquery()
+
+def srs_wrong_values(now):
+    columns = UserWords.__table__.c
+    lowered_ease = columns.ease - SRS_EASE_PENALTY
+    return {
+        'reps': 0,
+        'interval': 0.0,
+        'ease': sq.case((lowered_ease < SRS_MIN_EASE, SRS_MIN_EASE), else_=lowered_ease),
+        'due': now + SRS_RELEARN_DELAY,
+    }
+
+# Функция для увеличения счетчика правильных ответов на перевод слова.
+# Ключи (user_id, word_id) известны с момента показа вопроса, поэтому достаточно одного UPDATE,
+# который заодно переносит срок следующего повторения слова.
+@timed('db')
+@unit_of_work
+def increment_count(user_id, word_id):
+    if WRITE_BEHIND_ENABLED:
+        buffer_answer(user_id, word_id, correct=True)
+        return None
 
-            # Конвертируем словарь в строку и записываем в лог с поддержкой UTF-8
-            logger.info(json.dumps(log_entry, ensure_ascii=False))
+    try:
+        now = time.time()
+        user_words = UserWords.__table__
+        row = session.execute(
+            sq.update(user_words)
+            .where(user_words.c.user_id == user_id, user_words.c.word_id == word_id)
+            .values(count=user_words.c.count + 1, **srs_correct_values(now))
+            .returning(user_words.c.count, user_words.c.reps)
+        ).first()
+        if row is None:
+            session.commit()
+            return None
 
-            # print(f"Слово '{word.title()} / {word_to_delete.english_word.title()}' успешно удалено из словаря пользователя: {cid}.")
+        update_stats(user_id, correct_answers=UserStats.correct_answers + 1,
+                     mastered_words=UserStats.mastered_words + int(row.reps == MASTERED_REPS),
+                     **stats_activity_values(now))
+        session.commit()
+        return row.count
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
+
+# Фиксируем неправильный ответ: слово возвращается на повторное изучение
+@timed('db')
+@unit_of_work
+def record_wrong_answer(user_id, word_id):
+    if WRITE_BEHIND_ENABLED:
+        buffer_answer(user_id, word_id, correct=False)
+        return
+
+    try:
+        now = time.time()
+        user_words = UserWords.__table__
+        # Статистику обновляем до сброса повторений: выученное слово перестаёт быть выученным
+        was_mastered = sq.select(sq.func.count()).where(
+            user_words.c.user_id == user_id, user_words.c.word_id == word_id,
+            user_words.c.reps >= MASTERED_REPS).scalar_subquery()
+        update_stats(user_id, wrong_answers=UserStats.wrong_answers + 1,
+                     mastered_words=UserStats.mastered_words - was_mastered, **stats_activity_values(now))
+        session.execute(
+            sq.update(user_words)
+            .where(user_words.c.user_id == user_id, user_words.c.word_id == word_id)
+            .values(**srs_wrong_values(now))
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
 
-            return True
+# Пропуск слова кнопкой "Дальше": срок повторения переносится не раньше чем на SRS_SKIP_DELAY секунд,
+# и следующим выбирается другое слово из очереди
+@timed('db')
+@unit_of_work
+def postpone_word(user_id, word_id):
+    try:
+        user_words = UserWords.__table__
+        skip_until = time.time() + SRS_SKIP_DELAY
+        session.execute(
+            sq.update(user_words)
+            .where(user_words.c.user_id == user_id, user_words.c.word_id == word_id, user_words.c.due < skip_until)
+            .values(due=skip_until)
+        )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
 
+# Следующее слово к повторению: одно индексное чтение по (user_id, due), без загрузки словаря
+@timed('db')
+@unit_of_work
+def next_due_word(user_id, exclude_word_id=None):
+    with session.no_autoflush:
+        try:
+            query = session.query(UserWords.word_id) \
+                .filter(UserWords.user_id == user_id, UserWords.due <= time.time())
+            if exclude_word_id is not None:
+                query = query.filter(UserWords.word_id != exclude_word_id)
+            return query.order_by(UserWords.due).limit(1).scalar()
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
 
-# Функция для получения количества слов пользователя
-def get_user_word_count(cid):
+def buffer_answer(user_id, word_id, correct=True):
+    global _flush_thread
+
+    with _answer_lock:
+        buffer = _correct_buffer if correct else _wrong_buffer
+        buffer[(user_id, word_id)] += 1
+        pending = len(_correct_buffer) + len(_wrong_buffer)
+
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_flush_periodically, name='answer-flush', daemon=True)
+            _flush_thread.start()
+
+    if pending >= ANSWER_FLUSH_SIZE:
+        flush_answers()
+
+def _flush_periodically():
+    while True:
+        time.sleep(ANSWER_FLUSH_INTERVAL)
+        flush_answers()
+
+# Сбрасываем накопленные ответы в БД пакетными UPDATE (executemany)
+@timed('db')
+@unit_of_work
+def flush_answers():
+    with _answer_lock:
+        if not _correct_buffer and not _wrong_buffer:
+            return 0
+        now = time.time()
+        correct = [{'u': user_id, 'w': word_id, 'n': n, 'now': now} for (user_id, word_id), n in _correct_buffer.items()]
+        wrong = [{'u': user_id, 'w': word_id, 'now': now} for (user_id, word_id) in _wrong_buffer]
+
+        # Ответы каждого пользователя за период для его статистики
+        answers = {}
+        for (user_id, _), n in _correct_buffer.items():
+            answers.setdefault(user_id, {'su': user_id, 'correct': 0, 'wrong': 0})['correct'] += n
+        for (user_id, _), n in _wrong_buffer.items():
+            answers.setdefault(user_id, {'su': user_id, 'correct': 0, 'wrong': 0})['wrong'] += n
+        wrong_counts = dict(_wrong_buffer)
+        _correct_buffer.clear()
+        _wrong_buffer.clear()
+
+    try:
+        user_words = UserWords.__table__
+        link = sq.and_(user_words.c.user_id == sq.bindparam('u'), user_words.c.word_id == sq.bindparam('w'))
+
+        # Сначала ошибки, затем правильные ответы: правильный ответ после ошибки переносит повторение вперёд
+        if wrong:
+            session.execute(sq.update(user_words).where(link).values(**srs_wrong_values(sq.bindparam('now'))), wrong)
+        if correct:
+            session.execute(
+                sq.update(user_words).where(link)
+                .values(count=user_words.c.count + sq.bindparam('n'), **srs_correct_values(sq.bindparam('now'))),
+                correct,
+            )
+
+        # Выученные слова пересчитываем по словарю пользователя: порядок ответов внутри пакета не сохраняется
+        user_stats = UserStats.__table__
+        session.execute(
+            sq.update(user_stats).where(user_stats.c.user_id == sq.bindparam('su'))
+            .values(correct_answers=user_stats.c.correct_answers + sq.bindparam('correct'),
+                    wrong_answers=user_stats.c.wrong_answers + sq.bindparam('wrong'),
+                    mastered_words=words_count(sq.bindparam('su'), mastered=True),
+                    **stats_activity_values(now)),
+            list(answers.values()),
+        )
+        session.commit()
+        return len(correct) + len(wrong)
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
+
+        # Возвращаем события в буфер, чтобы не потерять их до следующей попытки
+        with _answer_lock:
+            for event in correct:
+                _correct_buffer[(event['u'], event['w'])] += event['n']
+            for key, n in wrong_counts.items():
+                _wrong_buffer[key] += n
+        return 0
+
+# При остановке процесса сбрасываем всё, что осталось в буфере
+atexit.register(flush_answers)
+
+# Статистика пользователя: словарь с полями UserStats или None, если пользователь не зарегистрирован
+@timed('db')
+@unit_of_work
+def get_user_stats(cid):
     with session.no_autoflush:
         try:
-            user = session.query(Users).filter_by(telegram_id=cid).first()
-            if not user:
-                return 0
-
-            # Количество слов пользователя
-            return session.query(UserWords).filter_by(user_id=user.id).count()
+            # Один запрос по уникальному индексу telegram_id, без загрузки индекса слов пользователя
+            row = session.query(UserStats).join(Users, Users.id == UserStats.user_id).filter(
+                Users.telegram_id == cid).first()
+            if row is None:
+                # Пользователь не зарегистрирован или зарегистрирован до появления статистики
+                # и ещё не попал в reconcile_user_stats
+                return None
+            return {column.name: getattr(row, column.name) for column in UserStats.__table__.columns}
         except Exception as e:
             session.rollback()
             print(f'Ошибка {e}')
 
-# create_tables(engine)
-# insert_data(russian_words)
\ No newline at end of file
+# Пересчитываем статистику по таблицам словаря пакетами пользователей: создаём недостающие записи
+# (правильные ответы - по счётчикам слов) и исправляем число слов и выученных слов. Число ошибок
+# и серия дней в исходных таблицах не хранятся и сохраняются как есть
+@timed('db')
+@unit_of_work
+def reconcile_user_stats(batch_size=RECONCILE_BATCH_SIZE):
+    users = Users.__table__
+    user_words = UserWords.__table__
+    user_stats = UserStats.__table__
+    result = {'created': 0, 'fixed': 0}
+
+    try:
+        max_id = session.execute(sq.select(sq.func.max(users.c.id))).scalar() or 0
+        for low in range(0, max_id + 1, batch_size):
+            in_batch = users.c.id.between(low, low + batch_size - 1)
+
+            correct_answers = sq.select(sq.func.coalesce(sq.func.sum(user_words.c.count), 0)) \
+                .where(user_words.c.user_id == users.c.id).scalar_subquery()
+            missing = sq.select(users.c.id, words_count(users.c.id), words_count(users.c.id, mastered=True),
+                                correct_answers, sq.literal(0), sq.literal(0), sq.literal(0)) \
+                .where(in_batch, ~sq.exists().where(user_stats.c.user_id == users.c.id))
+            created = session.execute(sq.insert(user_stats).from_select(
+                ['user_id', 'total_words', 'mastered_words', 'correct_answers', 'wrong_answers', 'streak',
+                 'best_streak'], missing))
+
+            total = words_count(user_stats.c.user_id)
+            mastered = words_count(user_stats.c.user_id, mastered=True)
+            fixed = session.execute(
+                sq.update(user_stats)
+                .where(user_stats.c.user_id.between(low, low + batch_size - 1),
+                       sq.or_(user_stats.c.total_words != total, user_stats.c.mastered_words != mastered))
+                .values(total_words=total, mastered_words=mastered)
+            )
+            session.commit()
+
+            result['created'] += created.rowcount
+            result['fixed'] += fixed.rowcount
+    except Exception as e:
+        session.rollback()
+        print(f'Ошибка {e}')
+        raise
+
+    log_event('reconcile_stats', RESULT='reconciled', CREATED=result['created'], FIXED=result['fixed'])
+    return result
+
+# Схема БД создаётся и обновляется командой `python migrate_config.py upgrade`
+# insert_data(russian_words)
@@ -0,0 +1,546 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from telebot import types
+
+from psql_config import (unit_of_work, get_user, add_user, random_target, other_words,
+                         add_word, del_word, get_user_word_count, increment_count, record_wrong_answer,
+                         postpone_word, get_user_stats, user_word_index)
+from cache_config import accepted_answers
+from common_config import normalize_answer
+import prefetch_config as prefetch
+from state_config import make_store
+from send_config import coalesce
+from import_config import (IMPORT_MAX_WORDS, IMPORT_MAX_BYTES, IMPORT_EXTENSIONS, parse_word_list, decode_document,
+                           import_words)
+from metrics_config import timed
+from trace_config import traced
+
+"""
+Модуль содержит бизнес-логику бота, общую для синхронного (TG_bot.py) и асинхронного (TG_bot_async.py) режимов.
+Функции не обращаются к Telegram API напрямую, а возвращают список ответов, которые отправляет сам бот.
+
+Основные функции:
+- start(cid): Обрабатывает команду '/start'.
+- process_name_input(cid, text): Регистрирует пользователя по введённому имени.
+- ask_question(cid, exclude_word_id=None, record=None): Показывает вопрос с вариантами перевода слова, которое пора
+  повторить (заранее подготовленный, если он есть), и готовит в фоне следующий.
+- build_question(cid, exclude_word_id=None): Подбирает слово и варианты ответа и формирует сообщение с вопросом.
+- handle_response(cid, text): Проверяет ответ пользователя на задание перевода.
+- handle_add_word(cid): Запрашивает слово для добавления в словарь.
+- process_add_word(cid, text): Добавляет слово в словарь пользователя.
+- handle_del_word(cid): Запрашивает слово для удаления из словаря.
+- process_del_word(cid, text): Удаляет слово из словаря пользователя.
+- handle_next(cid): Переходит к следующему вопросу.
+- handle_callback(cid, message_id, data): Обрабатывает нажатие inline-кнопки под вопросом.
+- handle_stats(cid): Показывает статистику пользователя (команда /stats).
+- handle_import(cid): Запрашивает список слов для массового импорта.
+- process_import(cid, text, csv_format=False): Запускает импорт списка слов в словарь пользователя в фоне.
+- run_import(cid, words): Импортирует слова и отправляет итоги через notify.
+- check_document(file_name, file_size): Проверяет загруженный файл до скачивания.
+- process_document(cid, file_name, data): Импортирует слова из загруженного файла .txt/.csv.
+- set_notifier(func): Задаёт функцию (cid, replies) для промежуточных ответов длительных операций.
+- has_pending_step(cid): Проверяет, ждёт ли бот от пользователя ввода (имени или слова).
+- handle_text(cid, text): Направляет текстовое сообщение ожидающему шагу, обработчику кнопки или проверке ответа.
+
+Следующий вопрос чата готовится заранее в фоне (prefetch_config), пока пользователь отвечает на текущий:
+ответ на правильный ответ не ждёт БД, а сам правильный ответ записывается тем же фоновым заданием
+до подготовки следующего вопроса. Если задание ещё не началось к следующему ответу, оно отменяется,
+а ответ записывается и вопрос подбирается в обработчике. Изменение словаря пользователя отбрасывает
+подготовленный вопрос.
+
+Каждая функция обработки обновления выполняется как единица работы (unit_of_work) со своей сессией БД;
+в режиме трассировки (trace_config) её SQL-запросы сверяются с бюджетом QUERY_BUDGETS.
+Ответ - это словарь с ключами 'text' и, при необходимости, 'reply_markup', 'parse_mode' и 'message_id'
+(если задан, бот редактирует это сообщение вместо отправки нового). Ответ с ключом 'tag' запоминается
+отправителем, и следующие ответы могут редактировать его, указав этот tag в 'message_id' (прогресс импорта).
+
+Режимы клавиатуры (QUIZ_KEYBOARD):
+- 'reply': варианты ответа на обычной клавиатуре, ответ приходит текстом.
+- 'inline': варианты ответа под сообщением с вопросом; нажатие приходит как callback_query
+  с компактными данными (id слова и номер варианта), и бот редактирует то же сообщение.
+"""
+
+ADD_WORD_BUTTON = 'Добавить слово "+" '
+DEL_WORD_BUTTON = 'Удалить слово "-" '
+NEXT_BUTTON = 'Дальше ⏭'
+
+QUIZ_KEYBOARD = 'reply'
+
+# Данные inline-кнопок: ответ 'a:<id слова>:<номер варианта>' и служебные кнопки
+ANSWER_CALLBACK = 'a'
+ADD_WORD_CALLBACK = 'add'
+DEL_WORD_CALLBACK = 'del'
+NEXT_CALLBACK = 'next'
+
+# Текущий вопрос чата хранится компактно: [user_id, word_id, русское слово, перевод, была ли ошибка, варианты ответа]
+current_question = make_store('question')
+
+# Шаги, ожидающие следующего сообщения пользователя: cid -> имя шага
+pending_steps = make_store('step')
+
+QUESTION_FIELDS = ('user_id', 'word_id', 'target_word', 'translated_word', 'missed', 'options')
+
+def get_question(cid):
+    record = current_question.get(cid)
+    if record is None:
+        return None
+    question = dict(zip(QUESTION_FIELDS, record))
+    # Вопрос мог быть сохранён до появления вариантов ответа в состоянии
+    question.setdefault('options', [question['translated_word']])
+    return question
+
+def set_question(cid, question):
+    current_question.set(cid, [question[field] for field in QUESTION_FIELDS])
+
+def reply(text, reply_markup=None, parse_mode=None, message_id=None, tag=None):
+    return {'text': text, 'reply_markup': reply_markup, 'parse_mode': parse_mode, 'message_id': message_id,
+            'tag': tag}
+
+# Промежуточные ответы длительных операций (прогресс импорта) отправляет бот через эту функцию
+_notifier = None
+
+def set_notifier(func):
+    global _notifier
+    _notifier = func
+
+def notify(cid, replies):
+    if _notifier is not None:
+        _notifier(cid, replies)
+
+# Ответы на нажатие inline-кнопки объединяются и заменяют текст и клавиатуру сообщения, под которым была кнопка
+def edit(message_id, replies):
+    messages = coalesce(replies)
+    if messages:
+        messages[0]['message_id'] = message_id
+    return messages
+
+@traced('handle_start')
+@timed('handler', 'handle_start')
+@unit_of_work
+def start(cid):
+    # Проверяем, существует ли пользователь
+    existing_user = get_user(cid)
+
+    if not existing_user:
+        # Если пользователя нет, просим ввести имя
+        set_pending_step(cid, 'name_input')
+        return [reply("Привет 👋\n\nДавай попрактикуемся в английском языке\\!\n\n"
+                      "Тренировки можешь проходить в удобном для себя темпе\\.\n\n"
+                      "У тебя есть возможность использовать тренажёр, как конструктор\\, так и собирать свою собственную базу для обучения\\.\n\n"
+                      "\\*Для этого воспользуйся инструментами:\\* \n"
+                      "\\- добавить слово ➕\n"
+                      "\\- удалить слово ❌\\.\n\n"
+                      "Ну что, начнём\\? Как тебя зовут\\? ", parse_mode="MarkdownV2")]
+
+    # Если пользователь известен, приветствуем его по имени и начинаем обучение с первого вопроса
+    greeting_message = f"Hello, {existing_user.name.title()}, let's continue learning English..."
+    return [reply(greeting_message)] + ask_question(cid)
+
+@traced()
+@timed('handler')
+@unit_of_work
+def process_name_input(cid, text):
+    user_name = text.strip()
+
+    # Регистрируем пользователя с введённым именем
+    add_user(cid, user_name=user_name.title())
+
+    # Приветствуем пользователя по имени и начинаем обучение с первого вопроса
+    greeting_message = f"Nice to meet you, {user_name.title()}! Let's start learning English..."
+    return [reply(greeting_message)] + ask_question(cid)
+
+# Подбираем вопрос: (состояние вопроса, сообщение с клавиатурой) или None, если в словаре нет слов
+def build_question(cid, exclude_word_id=None):
+    # Получаем слово, которое пора повторить (или случайное), вместе с переводом
+    target = random_target(cid, exclude_word_id)
+    if target is None:
+        return None
+
+    # Состояние вопроса: id, по которым будет записан ответ, и варианты ответа
+    target['translated_word'] = target['translated_word'].title()
+    target['missed'] = 0
+    target['options'] = make_options(target['translated_word'], target['word_id'])
+
+    # Генерация интерфейса с кнопками
+    return target, show_menu(target)
+
+# Фоновое задание чата: записываем итог показанного вопроса (record = (функция, user_id, word_id):
+# правильный ответ или пропуск), затем готовим следующий вопрос - уже с учётом нового срока повторения слова
+@unit_of_work
+def prefetch_question(cid, exclude_word_id, record=None):
+    if record is not None:
+        record[0](*record[1:])
+    return build_question(cid, exclude_word_id)
+
+@timed('handler')
+@unit_of_work
+def ask_question(cid, exclude_word_id=None, record=None):
+    prepared = prefetch.take(cid)
+    if prepared is not None and prepared[0]['word_id'] == exclude_word_id:
+        prepared = None
+
+    if prepared is None:
+        # Подготовленного вопроса нет (итог прошлого вопроса отменённого задания take уже записал):
+        # записываем итог и подбираем вопрос сразу
+        if record is not None:
+            record[0](*record[1:])
+            record = None
+        prepared = build_question(cid, exclude_word_id)
+
+    if prepared is None:
+        current_question.delete(cid)
+        return [reply("В вашем словаре пока нет слов. Добавьте слово, чтобы продолжить.",
+                      reply_markup=service_markup())]
+
+    target, menu = prepared
+    set_question(cid, target)
+
+    # Пока пользователь думает, готовим следующий вопрос (слово текущего вопроса не повторяем).
+    # Если задание не успеет начаться до следующего ответа, take отменит его и запишет итог сам
+    prefetch.schedule(cid, prefetch_question, cid, target['word_id'], record,
+                      fallback=partial(*record) if record is not None else None)
+    return [menu]
+
+def service_markup():
+    if QUIZ_KEYBOARD == 'inline':
+        return add_inline_service_buttons(types.InlineKeyboardMarkup())
+
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    markup.row(types.KeyboardButton(ADD_WORD_BUTTON), types.KeyboardButton(DEL_WORD_BUTTON))
+    markup.row(types.KeyboardButton(NEXT_BUTTON))
+    return markup
+
+# Правильный перевод и другие возможные переводы в случайном порядке
+def make_options(translated_word, word_id=None):
+    options = [translated_word] + [word.title() for word in other_words(translated_word, word_id)]
+    random.shuffle(options)
+    return options
+
+def show_menu(question, wrong_index=None):
+    if QUIZ_KEYBOARD == 'inline':
+        markup = inline_keyboard(question, wrong_index)
+    else:
+        markup = reply_keyboard(question)
+
+    # Берем текущее слово из состояния
+    target_word = question['target_word']
+    greeting = f"Выбери перевод слова:\n🇷🇺 {target_word.title()}"
+    return reply(greeting, reply_markup=markup)
+
+def reply_keyboard(question):
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+
+    # Кнопки вариантов перевода (правильный и похожие слова) в порядке, сохранённом в состоянии
+    buttons = [types.KeyboardButton(option) for option in question['options']]
+
+    # Стандартные кнопки "/add_word" и "/del_word"
+    add_word_btn = types.KeyboardButton(ADD_WORD_BUTTON)
+    del_word_btn = types.KeyboardButton(DEL_WORD_BUTTON)
+    next_btn = types.KeyboardButton(NEXT_BUTTON)
+    buttons.extend([add_word_btn, del_word_btn, next_btn])
+
+    # Добавляем кнопки построчно
+    for i in range(0, len(buttons), 2):
+        row_buttons = buttons[i:i+2]
+        markup.row(*row_buttons)
+
+    return markup
+
+def inline_keyboard(question, wrong_index=None):
+    markup = types.InlineKeyboardMarkup()
+
+    # Кнопка варианта передаёт id слова и номер варианта; неверно выбранный вариант помечаем
+    buttons = []
+    for i, option in enumerate(question['options']):
+        label = f'❌ {option}' if i == wrong_index else option
+        buttons.append(types.InlineKeyboardButton(label, callback_data=f"{ANSWER_CALLBACK}:{question['word_id']}:{i}"))
+
+    for i in range(0, len(buttons), 2):
+        markup.row(*buttons[i:i+2])
+
+    return add_inline_service_buttons(markup)
+
+def add_inline_service_buttons(markup):
+    markup.row(types.InlineKeyboardButton(ADD_WORD_BUTTON, callback_data=ADD_WORD_CALLBACK),
+               types.InlineKeyboardButton(DEL_WORD_BUTTON, callback_data=DEL_WORD_CALLBACK))
+    markup.row(types.InlineKeyboardButton(NEXT_BUTTON, callback_data=NEXT_CALLBACK))
+    return markup
+
+# Проверяем ответ на текущий вопрос: возвращаем (верен ли ответ, ответы пользователю)
+def check_answer(cid, question, answer):
+    # Правильный ответ - любой вариант перевода слова (без учёта регистра, ё/е и артикля)
+    accepted = accepted_answers(question['word_id']) or {normalize_answer(question['translated_word'])}
+
+    # Проверяем, есть ли нажатая кнопка или введённый ответ среди допустимых
+    if normalize_answer(answer) in accepted:
+        # Ответ правильный! Очистка данных после правильного ответа
+        current_question.delete(cid)
+        # Переход к следующему вопросу; ответ записывается вместе с подготовкой вопроса после следующего
+        return True, [reply("🎉 Правильно! Переходим к следующему слову.")] + \
+            ask_question(cid, question['word_id'], record=(increment_count, question['user_id'], question['word_id']))
+
+    # Неправильный ответ: оставляем прежний вопрос, а слово возвращаем на повторное изучение (один раз за вопрос)
+    if not question['missed']:
+        record_wrong_answer(question['user_id'], question['word_id'])
+        question['missed'] = 1
+        set_question(cid, question)
+
+    return False, [reply("❗ Ошибка! Попробуйте еще раз.")]
+
+@traced()
+@timed('handler')
+@unit_of_work
+def handle_response(cid, text):
+    # Получаем текущее слово и перевод из состояния
+    question = get_question(cid)
+
+    if question is None:
+        # Состояние потеряно (например, после перезапуска бота)
+        return [reply("Ой, похоже что-то пошло не так... Попробуем начать сначала.")] + ask_question(cid)
+
+    # С inline-клавиатурой ответ выбирается кнопкой, произвольный текст ответом не считается
+    if QUIZ_KEYBOARD == 'inline':
+        return [reply("Выберите ответ кнопкой под вопросом."), show_menu(question)]
+
+    return check_answer(cid, question, text)[1]
+
+@traced()
+@timed('handler')
+def handle_add_word(cid):
+    # Запрашиваем у пользователя слово для добавления
+    set_pending_step(cid, 'add_word')
+    return [reply("Введите русское слово, которое хотите добавить в словарь:")]
+
+@traced()
+@timed('handler')
+@unit_of_work
+def process_add_word(cid, text):
+    word = text.strip()
+
+    success, translated_word = add_word(cid, word)
+    if success:
+        # Получили успешный результат и перевод; подготовленный вопрос не учитывает изменившийся словарь
+        prefetch.invalidate(cid)
+        num_words = get_user_word_count(cid)
+        replies = [reply(f"Слово '{word.title()} / {translated_word.title()}' успешно добавлено. Всего слов в вашем словаре: {num_words}")]
+    elif translated_word is not None:
+        # Случай, когда слово уже есть в словаре
+        replies = [reply(f"Слово '{word.title()} / {translated_word.title()}' уже есть в вашем словаре.")]
+    else:
+        # Ошибка перевода или другое условие неудачи
+        replies = [reply(f"Перевод слова '{word.title()}' не найден. Добавить такое слово не получится.")]
+
+    return replies + ask_question(cid)
+
+@traced()
+@timed('handler')
+def handle_del_word(cid):
+    # Запрашиваем у пользователя слово для удаления
+    set_pending_step(cid, 'del_word')
+    return [reply("Введите русское слово, которое хотите удалить из словаря:")]
+
+@traced()
+@timed('handler')
+@unit_of_work
+def process_del_word(cid, text):
+    word = text.strip()
+
+    # Удаляем слово; перевод возвращается вместе с результатом, отдельный поиск слова не нужен
+    success, english_word = del_word(cid, word)
+    # Подготовленный вопрос мог быть об удалённом слове
+    if success:
+        prefetch.invalidate(cid)
+
+    if english_word is None:
+        return [reply(f"Cлова '{word.title()}' нет в Вашем словаре")] + ask_question(cid)
+
+    if success:
+        # Узнаем количество слов у пользователя
+        num_words = get_user_word_count(cid)
+        replies = [reply(f"Слово '{word.title()} / {english_word.title()}' успешно удалено. Всего слов в Вашем словаре: {num_words}")]
+    else:
+        replies = [reply(f"Слова '{word.title()} / {english_word.title()}' не было в Вашем словаре.")]
+
+    return replies + ask_question(cid)
+
+@traced()
+@timed('handler')
+@unit_of_work
+def handle_next(cid):
+    question = get_question(cid)
+    if question is None:
+        return ask_question(cid)
+
+    # Пропущенное слово откладываем: у новых слов одинаковый срок (due = 0), и без этого "Дальше"
+    # чередовало бы два первых слова очереди
+    return ask_question(cid, question['word_id'], record=(postpone_word, question['user_id'], question['word_id']))
+
+# Нажатие варианта ответа на inline-клавиатуре
+def answer_option(cid, word_id, index):
+    question = get_question(cid)
+    if question is None:
+        return [reply("Ой, похоже что-то пошло не так... Попробуем начать сначала.")] + ask_question(cid)
+
+    if question['word_id'] != word_id or not 0 <= index < len(question['options']):
+        # Кнопка под уже неактуальным вопросом: показываем текущий вопрос
+        return [reply("Этот вопрос уже неактуален."), show_menu(question)]
+
+    correct, replies = check_answer(cid, question, question['options'][index])
+    if not correct:
+        replies.append(show_menu(question, wrong_index=index))
+    return replies
+
+@traced()
+@timed('handler')
+@unit_of_work
+def handle_callback(cid, message_id, data):
+    if data == NEXT_CALLBACK:
+        return edit(message_id, handle_next(cid))
+    if data == ADD_WORD_CALLBACK:
+        return edit(message_id, handle_add_word(cid))
+    if data == DEL_WORD_CALLBACK:
+        return edit(message_id, handle_del_word(cid))
+
+    parts = data.split(':')
+    if len(parts) == 3 and parts[0] == ANSWER_CALLBACK and parts[1].isdigit() and parts[2].isdigit():
+        return edit(message_id, answer_option(cid, int(parts[1]), int(parts[2])))
+    return []
+
+# Статистика хранится готовой (psql_config.UserStats), поэтому команда читает одну запись
+@traced()
+@timed('handler')
+@unit_of_work
+def handle_stats(cid):
+    stats = get_user_stats(cid)
+    if stats is None:
+        return [reply("Статистика пока недоступна. Чтобы начать занятия, отправьте /start")]
+
+    answers = stats['correct_answers'] + stats['wrong_answers']
+    accuracy = round(100 * stats['correct_answers'] / answers) if answers else 0
+    last_active = time.strftime('%d.%m.%Y %H:%M', time.localtime(stats['last_active'])) \
+        if stats['last_active'] else 'ещё не было ответов'
+
+    return [reply("📊 Ваша статистика\n\n"
+                  f"Слов в словаре: {stats['total_words']}\n"
+                  f"Выучено: {stats['mastered_words']}\n"
+                  f"Правильных ответов: {stats['correct_answers']}, ошибок: {stats['wrong_answers']} "
+                  f"(точность {accuracy}%)\n"
+                  f"Дней занятий подряд: {stats['streak']} (рекорд: {stats['best_streak']})\n"
+                  f"Последнее занятие: {last_active}")]
+
+# Сообщение с ходом импорта отправляется с этим tag и затем редактируется
+IMPORT_PROGRESS_TAG = 'import'
+# Одновременно выполняемые импорты (переводы внутри импорта ограничивает пул import_config)
+IMPORT_RUNNERS = 2
+
+# Импорт длится долго (до IMPORT_MAX_WORDS запросов к словарю): в потоке-обработчике он задержал бы
+# все чаты его шарда, поэтому выполняется в отдельном пуле, а ход и итоги отправляются через notify
+_import_executor = ThreadPoolExecutor(max_workers=IMPORT_RUNNERS, thread_name_prefix='import-run')
+
+# Импортировать слова может только зарегистрированный пользователь: иначе слова переводились бы
+# и попадали в общий словарь, не попадая ни в чей личный. Индекс слов всё равно нужен импорту
+def not_registered_reply(cid):
+    if user_word_index(cid) is None:
+        return [reply("Сначала зарегистрируйтесь: отправьте /start")]
+    return None
+
+@timed('handler')
+def handle_import(cid):
+    not_registered = not_registered_reply(cid)
+    if not_registered:
+        return not_registered
+
+    # Запрашиваем у пользователя список слов для импорта
+    set_pending_step(cid, 'import_words')
+    return [reply("Отправьте список русских слов: по одному в строке или через запятую. "
+                  "Можно прислать файл .txt или .csv (слова в первом столбце).")]
+
+@timed('handler')
+def process_import(cid, text, csv_format=False):
+    not_registered = not_registered_reply(cid)
+    if not_registered:
+        return not_registered
+
+    # Разбираем не больше лимита (+1 слово, чтобы сообщить о превышении)
+    words = list(islice(parse_word_list(text, csv_format), IMPORT_MAX_WORDS + 1))
+    if not words:
+        return [reply("Не удалось найти в списке русских слов.")] + ask_question(cid)
+
+    notify(cid, [reply(f"Импортирую слов: {min(len(words), IMPORT_MAX_WORDS)}...", tag=IMPORT_PROGRESS_TAG)])
+    _import_executor.submit(run_import, cid, words)
+    return []
+
+def _word_list_line(title, words):
+    line = f"\n{title}: " + ', '.join(words[:10])
+    return line + ', ...' if len(words) > 10 else line
+
+# Импорт выполняется без общей сессии: каждый пакетный запрос берёт соединение из пула только на своё время
+def run_import(cid, words):
+    try:
+        result = import_words(cid, words, progress=lambda done, total: notify(
+            cid, [reply(f"Импортировано {done} из {total} слов...", message_id=IMPORT_PROGRESS_TAG)]))
+    except Exception as e:
+        print(f'Ошибка {e}')
+        summary = "Импорт прерван из-за ошибки. Часть слов могла быть добавлена - попробуйте повторить импорт позже."
+    else:
+        summary = (f"Импорт завершён. Добавлено слов: {result['added']}, уже были в словаре: {result['already']}, "
+                   f"без перевода: {len(result['not_found'])}.")
+        if result['not_found']:
+            summary += _word_list_line("Не удалось перевести", result['not_found'])
+        if result['too_long']:
+            summary += _word_list_line("Слишком длинный перевод", result['too_long'])
+        if len(words) > result['total']:
+            summary += f"\nЗа один раз импортируется не больше {result['total']} слов."
+
+    # Подготовленный вопрос не учитывает импортированные слова
+    prefetch.invalidate(cid)
+    notify(cid, [reply(summary, message_id=IMPORT_PROGRESS_TAG)] + ask_question(cid))
+
+def check_document(file_name, file_size):
+    if not (file_name or '').lower().endswith(IMPORT_EXTENSIONS):
+        return [reply("Для импорта пришлите файл .txt или .csv.")]
+    if file_size and file_size > IMPORT_MAX_BYTES:
+        return [reply(f"Файл слишком большой: не больше {IMPORT_MAX_BYTES // 1024} КБ.")]
+    return []
+
+def process_document(cid, file_name, data):
+    # Файл заменяет ожидаемый текстовый список
+    if pending_steps.get(cid) == 'import_words':
+        pending_steps.delete(cid)
+    return process_import(cid, decode_document(data), csv_format=file_name.lower().endswith('.csv'))
+
+# Шаги, которые ожидают следующего сообщения пользователя
+STEPS = {
+    'name_input': process_name_input,
+    'add_word': process_add_word,
+    'del_word': process_del_word,
+    'import_words': process_import,
+}
+
+def set_pending_step(cid, step):
+    pending_steps.set(cid, step)
+
+def has_pending_step(cid):
+    return cid in pending_steps
+
+# Кнопки обычной клавиатуры ищутся по точному тексту (без крайних пробелов, которые клиент может отбросить)
+BUTTONS = {
+    ADD_WORD_BUTTON.strip(): handle_add_word,
+    DEL_WORD_BUTTON.strip(): handle_del_word,
+    NEXT_BUTTON.strip(): handle_next,
+}
+
+@unit_of_work
+def handle_text(cid, text):
+    step = pending_steps.pop(cid)
+    if step is not None:
+        return STEPS[step](cid, text)
+
+    handler = BUTTONS.get(text.strip())
+    if handler is not None:
+        return handler(cid)
+    return handle_response(cid, text)
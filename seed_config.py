@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from YAD_config import translate_entry
+from psql_config import (russian_words, existing_russian_words, insert_words_batch, refresh_vocabulary,
+                         WORD_MAX_LENGTH)
+
+"""
+Потоковое наполнение общего словаря (таблица words) русскими словами с переводом.
+
+Слова читаются порциями, уже существующие в БД отсекаются одним запросом на порцию,
+остальные переводятся в ограниченном пуле потоков и записываются пакетным INSERT ... ON CONFLICT DO NOTHING.
+Слова и переводы длиннее столбцов таблицы words (WORD_MAX_LENGTH) пропускаются: иначе БД отвергла бы
+весь пакет, и повторный запуск каждый раз останавливался бы на нём.
+После каждой порции сохраняется контрольная точка, поэтому повторный запуск продолжает с места остановки.
+Контрольная точка хранит отпечаток источника (размер и время изменения файла, хэш списка) и не применяется,
+если источник изменился; слова из stdin не возобновляются - повторный запуск обрабатывает их заново.
+Таблицы users и user_words не затрагиваются.
+
+Основные функции:
+- read_words(source): Читает слова из списка, файла или stdin ('-').
+- seed_words(words, source): Наполняет общий словарь переданными словами.
+- main(): Запуск из командной строки.
+
+Пример:
+    python seed_config.py --file words.txt --workers 16
+    cat words.txt | python seed_config.py --file -
+"""
+
+SEED_WORKERS = 8
+SEED_BATCH_SIZE = 500
+SEED_CHECKPOINT_FILE = 'seed_checkpoint.json'
+
+# Читаем слова из списка, файла или stdin, по одному слову в строке
+def read_words(source):
+    if isinstance(source, str) and source != '-':
+        with open(source, 'r', encoding='utf-8') as file:
+            yield from read_words(file)
+        return
+
+    lines = sys.stdin if source == '-' else source
+
+    seen = set()
+    for line in lines:
+        word = line.strip().lower()
+        if word and word not in seen:
+            seen.add(word)
+            yield word
+
+# Отпечаток содержимого источника; None - источник нельзя прочитать повторно (stdin, итератор)
+def source_fingerprint(words):
+    if isinstance(words, str):
+        if words == '-':
+            return None
+        stat = os.stat(words)
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    if isinstance(words, (list, tuple)):
+        return hashlib.sha1('\n'.join(words).encode('utf-8')).hexdigest()
+    return None
+
+def load_checkpoint(source, fingerprint):
+    if fingerprint is None or not os.path.exists(SEED_CHECKPOINT_FILE):
+        return 0
+
+    with open(SEED_CHECKPOINT_FILE, 'r', encoding='utf-8') as file:
+        checkpoint = json.load(file)
+
+    # Контрольная точка относится только к тому же источнику слов с тем же содержимым
+    if checkpoint.get('source') != source or checkpoint.get('fingerprint') != fingerprint:
+        return 0
+    return checkpoint.get('offset', 0)
+
+def save_checkpoint(source, fingerprint, offset):
+    if fingerprint is None:
+        return
+
+    tmp_name = SEED_CHECKPOINT_FILE + '.tmp'
+    with open(tmp_name, 'w', encoding='utf-8') as file:
+        json.dump({'source': source, 'fingerprint': fingerprint, 'offset': offset}, file, ensure_ascii=False)
+    os.replace(tmp_name, SEED_CHECKPOINT_FILE)
+
+def _batches(words, size):
+    iterator = iter(words)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def seed_words(words, source='russian_words', workers=SEED_WORKERS, batch_size=SEED_BATCH_SIZE):
+    fingerprint = source_fingerprint(words)
+    offset = load_checkpoint(source, fingerprint)
+    if offset:
+        print(f'Продолжаем с контрольной точки: пропускаем {offset} слов')
+
+    words = islice(read_words(words), offset, None)
+    processed = offset
+    added = 0
+    not_found = 0
+    skipped = 0
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='seed') as executor:
+        for batch in _batches(words, batch_size):
+            # Переводим только слова, которых ещё нет в БД
+            known = existing_russian_words(batch)
+            missing = [word for word in batch if word not in known]
+
+            variants = dict(found for found in executor.map(translate_entry, missing) if found is not None)
+            pairs = [(word, found[0][0].lower()) for word, found in variants.items()]
+            not_found += len(missing) - len(pairs)
+            fitting = [(word, translation) for word, translation in pairs
+                       if len(word) <= WORD_MAX_LENGTH and len(translation) <= WORD_MAX_LENGTH]
+            skipped += len(pairs) - len(fitting)
+            added += insert_words_batch(fitting, variants)
+
+            processed += len(batch)
+            save_checkpoint(source, fingerprint, processed)
+
+            elapsed = time.monotonic() - started
+            rate = (processed - offset) / elapsed if elapsed else 0.0
+            print(f'Обработано: {processed}, добавлено: {added}, без перевода: {not_found}, '
+                  f'пропущено длинных: {skipped}, {rate:.1f} слов/с')
+
+    refresh_vocabulary(force=True)
+
+    # Источник обработан полностью, контрольная точка больше не нужна
+    if os.path.exists(SEED_CHECKPOINT_FILE):
+        os.remove(SEED_CHECKPOINT_FILE)
+
+    print(f'Готово: добавлено {added} слов, без перевода {not_found}, пропущено длинных {skipped}')
+    return added
+
+def main():
+    parser = argparse.ArgumentParser(description='Наполнение общего словаря русскими словами с переводом')
+    parser.add_argument('--file', help="файл со словами (по одному в строке) или '-' для stdin; "
+                                       "по умолчанию встроенный список russian_words")
+    parser.add_argument('--workers', type=int, default=SEED_WORKERS, help='число потоков перевода')
+    parser.add_argument('--batch', type=int, default=SEED_BATCH_SIZE, help='размер пакета вставки')
+    parser.add_argument('--restart', action='store_true', help='игнорировать сохранённую контрольную точку')
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(SEED_CHECKPOINT_FILE):
+        os.remove(SEED_CHECKPOINT_FILE)
+
+    if args.file:
+        seed_words(args.file, source=args.file, workers=args.workers, batch_size=args.batch)
+    else:
+        seed_words(russian_words, source='russian_words', workers=args.workers, batch_size=args.batch)
+
+if __name__ == '__main__':
+    main()
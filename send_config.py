@@ -0,0 +1,273 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict, deque
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+import metrics_config
+
+"""
+Очередь исходящих сообщений бота с ограничением частоты отправки.
+
+Обработчики не ждут Telegram API, а ставят ответы в очередь (enqueue). Потоки-отправители соблюдают
+общий лимит (GLOBAL_RATE сообщений в секунду) и лимит на чат (PER_CHAT_RATE), при ответе 429
+выдерживают паузу retry_after и повторяют отправку. Подряд идущие ответы одному чату объединяются
+в одно сообщение: например, "🎉 Правильно!" и следующий вопрос с клавиатурой уходят одним запросом.
+Ответ с ключом 'message_id' не отправляется заново, а редактирует это сообщение (режим inline-клавиатуры).
+Id сообщения, отправленного с ключом 'tag', запоминается: следующие ответы этому чату могут редактировать
+его, указав tag вместо 'message_id' (так обновляется сообщение с ходом импорта).
+
+Основные функции:
+- coalesce(replies): Объединяет подряд идущие ответы в минимальное число сообщений.
+- enqueue(cid, replies): Ставит ответы в очередь на отправку.
+- deliver(bot, cid, message): Отправляет сообщение или редактирует существующее.
+- start_sender(bot): Запускает потоки-отправители.
+- drain(timeout): Ждёт, пока очередь опустеет.
+- outbox_stats(): Возвращает счётчики очереди отправки.
+"""
+
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+SEND_WORKERS = 8
+DRAIN_TIMEOUT = 5
+MAX_TRACKED_CHATS = 10000
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    # Возвращает 0, если токен получен, иначе - сколько секунд ждать до появления токена
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+_cond = threading.Condition()
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+_chat_buckets = {}
+# cid -> очередь ответов; cid -> время, до которого чат заблокирован после 429
+_outbox = {}
+_blocked_until = {}
+# Чаты с ожидающими сообщениями, которые сейчас не отправляются другим потоком
+_ready = deque()
+_in_flight = set()
+_sender_threads = []
+# (cid, tag) -> id отправленного сообщения
+_tagged = OrderedDict()
+
+stats = {
+    'enqueued': 0,
+    'sent': 0,
+    'coalesced': 0,
+    'retried': 0,
+    'failed': 0,
+}
+
+# Можно ли присоединить ответ к предыдущему: предыдущий без клавиатуры и tag, тот же parse_mode;
+# правка принимает следующие ответы (кроме обычной клавиатуры, которую нельзя поставить правкой),
+# но сама к предыдущим не присоединяется
+def _can_merge(previous, item):
+    if previous['reply_markup'] is not None or previous.get('tag') or previous['parse_mode'] != item['parse_mode']:
+        return False
+    if item.get('message_id') is not None:
+        return False
+    return previous.get('message_id') is None or not isinstance(item['reply_markup'], types.ReplyKeyboardMarkup)
+
+def coalesce(replies):
+    result = []
+    for item in replies:
+        previous = result[-1] if result else None
+        if previous is not None and _can_merge(previous, item):
+            result[-1] = {
+                'text': previous['text'] + '\n\n' + item['text'],
+                'reply_markup': item['reply_markup'],
+                'parse_mode': item['parse_mode'],
+                'message_id': previous.get('message_id'),
+                'tag': item.get('tag'),
+            }
+        else:
+            result.append(dict(item))
+    return result
+
+def enqueue(cid, replies):
+    with _cond:
+        pending = _outbox.setdefault(cid, deque())
+        pending.extend(replies)
+        stats['enqueued'] += len(replies)
+
+        if cid not in _in_flight and cid not in _ready:
+            _ready.append(cid)
+        _cond.notify()
+
+def outbox_stats():
+    with _cond:
+        result = dict(stats)
+        result['pending'] = sum(len(pending) for pending in _outbox.values())
+        result['chats'] = len(_outbox)
+    return result
+
+# Выбираем чат, которому можно отправить сообщение прямо сейчас; иначе возвращаем время ожидания
+def _next_chat():
+    now = time.monotonic()
+    wait = None
+
+    for _ in range(len(_ready)):
+        cid = _ready.popleft()
+
+        delay = _blocked_until.get(cid, 0) - now
+        if delay <= 0:
+            bucket = _chat_buckets.setdefault(cid, TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST))
+            delay = bucket.take()
+
+        if delay <= 0:
+            return cid, None
+
+        _ready.append(cid)
+        wait = delay if wait is None else min(wait, delay)
+
+    return None, wait
+
+def _take_message(cid):
+    pending = _outbox[cid]
+    replies = []
+    while pending:
+        replies.append(pending.popleft())
+        if replies[-1]['reply_markup'] is not None:
+            break
+
+    messages = coalesce(replies)
+    stats['coalesced'] += len(replies) - len(messages)
+
+    # Остаток снова ставим в начало очереди чата
+    pending.extendleft(reversed(messages[1:]))
+    return messages[0]
+
+def _release_chat(cid):
+    _in_flight.discard(cid)
+    if _outbox.get(cid):
+        _ready.append(cid)
+        _cond.notify()
+    else:
+        _outbox.pop(cid, None)
+        _cond.notify_all()
+
+    # Забываем лимиты чатов, которые давно ничего не получали
+    if len(_chat_buckets) > MAX_TRACKED_CHATS:
+        now = time.monotonic()
+        idle = [chat for chat, bucket in _chat_buckets.items()
+                if chat not in _outbox and now - bucket.updated_at > PER_CHAT_BURST / PER_CHAT_RATE
+                and _blocked_until.get(chat, 0) < now]
+        for chat in idle:
+            _chat_buckets.pop(chat, None)
+            _blocked_until.pop(chat, None)
+
+# Отправляем новое сообщение или редактируем существующее (по id или по tag ранее отправленного сообщения)
+def deliver(bot, cid, message):
+    message_id = message.get('message_id')
+    if isinstance(message_id, str):
+        with _cond:
+            message_id = _tagged.get((cid, message_id))
+
+    if message_id:
+        bot.edit_message_text(message['text'], cid, message_id, reply_markup=message['reply_markup'],
+                              parse_mode=message['parse_mode'])
+        return
+
+    sent = bot.send_message(cid, message['text'], reply_markup=message['reply_markup'],
+                            parse_mode=message['parse_mode'])
+    if message.get('tag'):
+        with _cond:
+            _tagged[(cid, message['tag'])] = sent.message_id
+            while len(_tagged) > MAX_TRACKED_CHATS:
+                _tagged.popitem(last=False)
+
+def _sender(bot):
+    while True:
+        with _cond:
+            cid, wait = _next_chat()
+            while cid is None:
+                _cond.wait(wait)
+                cid, wait = _next_chat()
+
+            _in_flight.add(cid)
+            message = _take_message(cid)
+
+            # Общий лимит бота на все чаты
+            delay = _global_bucket.take()
+            while delay > 0:
+                _cond.wait(delay)
+                delay = _global_bucket.take()
+
+        started = time.perf_counter()
+        method = 'telegram_edit_message' if message.get('message_id') else 'telegram_send_message'
+        try:
+            deliver(bot, cid, message)
+        except ApiTelegramException as e:
+            if metrics_config.METRICS_ENABLED:
+                metrics_config.observe('external', method, time.perf_counter() - started, True)
+            with _cond:
+                if e.error_code == 429:
+                    # Telegram просит подождать: возвращаем сообщение в начало очереди чата
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    _blocked_until[cid] = time.monotonic() + retry_after
+                    _outbox[cid].appendleft(message)
+                    stats['retried'] += 1
+                elif 'message is not modified' in str(e.description):
+                    # Повторное нажатие той же кнопки: сообщение уже в нужном виде
+                    stats['sent'] += 1
+                else:
+                    stats['failed'] += 1
+                    print(f'Ошибка {e}')
+                _release_chat(cid)
+            continue
+        except Exception as e:
+            if metrics_config.METRICS_ENABLED:
+                metrics_config.observe('external', method, time.perf_counter() - started, True)
+            with _cond:
+                stats['failed'] += 1
+                _release_chat(cid)
+            print(f'Ошибка {e}')
+            continue
+
+        if metrics_config.METRICS_ENABLED:
+            metrics_config.observe('external', method, time.perf_counter() - started)
+
+        with _cond:
+            stats['sent'] += 1
+            _release_chat(cid)
+
+def start_sender(bot, workers=SEND_WORKERS):
+    if _sender_threads:
+        return
+
+    for i in range(workers):
+        thread = threading.Thread(target=_sender, args=(bot,), name=f'sender-{i}', daemon=True)
+        thread.start()
+        _sender_threads.append(thread)
+
+# Ждём отправки накопленных сообщений (например, при остановке бота)
+def drain(timeout=DRAIN_TIMEOUT):
+    if not _sender_threads:
+        return
+
+    deadline = time.monotonic() + timeout
+    with _cond:
+        while _outbox or _in_flight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            _cond.wait(remaining)
+
+atexit.register(drain)
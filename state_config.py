@@ -0,0 +1,200 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sq
+
+from psql_config import QuizState, session, unit_of_work, dialect_insert
+
+"""
+Хранилище состояния диалога с пользователем (текущий вопрос, ожидаемый шаг).
+
+Бэкенды (QUIZ_STATE_BACKEND):
+- 'memory': словарь в памяти процесса с вытеснением по TTL и LRU. Не переживает перезапуск.
+- 'sqlite': локальный файл SQLite. Переживает перезапуск, общий для процессов на одной машине.
+- 'postgres': таблица quiz_state в основной БД. Общий для всех экземпляров бота.
+
+Значения хранятся компактно - как JSON-массивы/строки. Записи с истёкшим TTL в 'sqlite' и 'postgres'
+удаляются при записи не чаще раза в QUIZ_STATE_PURGE_INTERVAL секунд (purge_expired).
+
+Основные функции:
+- make_store(kind): Создает хранилище заданного вида ('question', 'step') на выбранном бэкенде.
+"""
+
+QUIZ_STATE_BACKEND = 'memory'
+QUIZ_STATE_TTL = 24 * 60 * 60
+QUIZ_STATE_MAX_CHATS = 100000
+QUIZ_STATE_SQLITE_FILE = 'quiz_state.sqlite3'
+# Как часто хранилища на диске и в БД удаляют записи чатов с истёкшим TTL (проверяется при записи)
+QUIZ_STATE_PURGE_INTERVAL = 60 * 60
+
+class MemoryStateStore:
+    def __init__(self, kind, ttl=QUIZ_STATE_TTL, max_size=QUIZ_STATE_MAX_CHATS):
+        self.kind = kind
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cid):
+        with self._lock:
+            item = self._items.get(cid)
+            if item is None:
+                return None
+
+            value, updated_at = item
+            if time.time() - updated_at >= self.ttl:
+                del self._items[cid]
+                return None
+
+            self._items.move_to_end(cid)
+            return value
+
+    def set(self, cid, value):
+        with self._lock:
+            self._items[cid] = (value, time.time())
+            self._items.move_to_end(cid)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, cid):
+        with self._lock:
+            item = self._items.pop(cid, None)
+        if item is None or time.time() - item[1] >= self.ttl:
+            return None
+        return item[0]
+
+    def delete(self, cid):
+        with self._lock:
+            self._items.pop(cid, None)
+
+    def __contains__(self, cid):
+        return self.get(cid) is not None
+
+# Периодическая очистка хранилищ, где истёкшие записи сами не вытесняются: без неё таблица
+# quiz_state росла бы на каждый чат, когда-либо писавший боту
+class PurgingStateStore:
+    purge_interval = QUIZ_STATE_PURGE_INTERVAL
+    _purged_at = None
+
+    def _purge_if_due(self):
+        now = time.monotonic()
+        if self._purged_at is None or now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            self.purge_expired()
+
+class SQLiteStateStore(PurgingStateStore):
+    def __init__(self, kind, path=QUIZ_STATE_SQLITE_FILE, ttl=QUIZ_STATE_TTL):
+        self.kind = kind
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        # WAL позволяет нескольким процессам читать и писать файл одновременно
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS quiz_state ("
+                         "kind TEXT, chat_id INTEGER, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+                         "PRIMARY KEY (kind, chat_id))")
+        self._db.commit()
+
+    def get(self, cid):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM quiz_state WHERE kind = ? AND chat_id = ? AND updated_at > ?",
+                                   (self.kind, cid, time.time() - self.ttl)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, cid, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO quiz_state (kind, chat_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                             (self.kind, cid, json.dumps(value, ensure_ascii=False), time.time()))
+            self._db.commit()
+        self._purge_if_due()
+
+    def pop(self, cid):
+        with self._lock:
+            row = self._db.execute("DELETE FROM quiz_state WHERE kind = ? AND chat_id = ? RETURNING data, updated_at",
+                                   (self.kind, cid)).fetchone()
+            self._db.commit()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def delete(self, cid):
+        self.pop(cid)
+
+    def purge_expired(self):
+        with self._lock:
+            self._db.execute("DELETE FROM quiz_state WHERE updated_at <= ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def __contains__(self, cid):
+        return self.get(cid) is not None
+
+class PostgresStateStore(PurgingStateStore):
+    def __init__(self, kind, ttl=QUIZ_STATE_TTL):
+        self.kind = kind
+        self.ttl = ttl
+
+    @unit_of_work
+    def get(self, cid):
+        data = session.query(QuizState.data).filter(QuizState.kind == self.kind, QuizState.chat_id == cid,
+                                                    QuizState.updated_at > time.time() - self.ttl).scalar()
+        return None if data is None else json.loads(data)
+
+    @unit_of_work
+    def set(self, cid, value):
+        try:
+            values = {'kind': self.kind, 'chat_id': cid, 'data': json.dumps(value, ensure_ascii=False),
+                      'updated_at': time.time()}
+            stmt = dialect_insert(QuizState).values(**values)
+            stmt = stmt.on_conflict_do_update(index_elements=['kind', 'chat_id'],
+                                              set_={'data': values['data'], 'updated_at': values['updated_at']})
+            session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+        self._purge_if_due()
+
+    @unit_of_work
+    def pop(self, cid):
+        try:
+            row = session.execute(
+                sq.delete(QuizState)
+                .where(QuizState.kind == self.kind, QuizState.chat_id == cid)
+                .returning(QuizState.data, QuizState.updated_at)
+            ).first()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+            return None
+
+        if row is None or time.time() - row.updated_at >= self.ttl:
+            return None
+        return json.loads(row.data)
+
+    def delete(self, cid):
+        self.pop(cid)
+
+    @unit_of_work
+    def purge_expired(self):
+        try:
+            session.execute(sq.delete(QuizState).where(QuizState.updated_at <= time.time() - self.ttl))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f'Ошибка {e}')
+
+    def __contains__(self, cid):
+        return self.get(cid) is not None
+
+BACKENDS = {
+    'memory': MemoryStateStore,
+    'sqlite': SQLiteStateStore,
+    'postgres': PostgresStateStore,
+}
+
+def make_store(kind, backend=None):
+    return BACKENDS[backend or QUIZ_STATE_BACKEND](kind)
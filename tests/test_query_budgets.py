@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+from itertools import count
+
+import pytest
+
+"""
+Проверка бюджетов SQL-запросов обработчиков quiz_config (trace_config.QUERY_BUDGETS).
+
+Окружение готовится так же, как в bench_config: временный каталог с токенами и БД SQLite (BOT_DSN).
+Перевод подменяется словарём, чтобы тесты не обращались к Yandex.Dictionary. Фоновая подготовка
+вопроса (prefetch_config) выключена: обработчик выполняет всю работу сам, и бюджет проверяет её целиком.
+
+Запуск:
+    python -m pytest -q tests
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = {
+    'кот': 'cat', 'пёс': 'dog', 'дом': 'house', 'мир': 'world', 'сон': 'dream',
+    'лес': 'forest', 'река': 'river', 'море': 'sea', 'дуб': 'oak', 'гриб': 'mushroom',
+}
+NEW_WORD = ('кит', 'whale')
+
+chat_ids = count(1000)
+
+@pytest.fixture(scope='module')
+def quiz():
+    workdir = tempfile.mkdtemp(prefix='budget_')
+    for filename, content in (('token_TG.txt', '123456:TEST'), ('token_YAD.txt', 'test'),
+                              ('DSN_password.txt', 'test')):
+        with open(os.path.join(workdir, filename), 'w', encoding='utf-8') as file:
+            file.write(content)
+    os.environ['BOT_DSN'] = f"sqlite:///{os.path.join(workdir, 'test.sqlite3')}"
+    os.chdir(workdir)
+
+    # Модули бота читают токены и подключаются к БД при импорте
+    sys.path.insert(0, ROOT)
+    import prefetch_config
+    import psql_config
+    import quiz_config
+
+    prefetch_config.PREFETCH_ENABLED = False
+    translations = dict(WORDS, **{NEW_WORD[0]: NEW_WORD[1]})
+    psql_config.translate_variants = lambda word: [(translations[word], 'noun')] if word in translations else []
+
+    psql_config.create_tables(psql_config.engine)
+    psql_config.insert_words_batch(list(WORDS.items()))
+    psql_config.refresh_vocabulary(force=True)
+    return quiz_config
+
+@pytest.fixture
+def cid(quiz):
+    # Зарегистрированный пользователь с вопросом на экране
+    chat_id = next(chat_ids)
+    quiz.start(chat_id)
+    quiz.process_name_input(chat_id, 'Tester')
+    return chat_id
+
+def within_budget(name, func, *args):
+    from trace_config import QUERY_BUDGETS, query_budget
+
+    with query_budget(QUERY_BUDGETS[name], name):
+        return func(*args)
+
+def test_handle_start_new_user(quiz):
+    replies = within_budget('handle_start', quiz.start, next(chat_ids))
+    assert 'Как тебя зовут' in replies[0]['text']
+
+def test_process_name_input(quiz):
+    chat_id = next(chat_ids)
+    quiz.start(chat_id)
+    replies = within_budget('process_name_input', quiz.process_name_input, chat_id, 'Tester')
+    assert quiz.get_question(chat_id) is not None
+    assert 'Tester' in replies[0]['text']
+
+def test_handle_response_wrong(quiz, cid):
+    replies = within_budget('handle_response', quiz.handle_response, cid, '-')
+    assert replies[0]['text'].startswith('❗')
+
+def test_handle_response_correct(quiz, cid):
+    question = quiz.get_question(cid)
+    replies = within_budget('handle_response', quiz.handle_response, cid, question['translated_word'])
+    assert replies[0]['text'].startswith('🎉')
+    assert quiz.get_question(cid)['word_id'] != question['word_id']
+
+def test_handle_next(quiz, cid):
+    question = quiz.get_question(cid)
+    within_budget('handle_next', quiz.handle_next, cid)
+    assert quiz.get_question(cid)['word_id'] != question['word_id']
+
+def test_handle_stats(quiz, cid):
+    replies = within_budget('handle_stats', quiz.handle_stats, cid)
+    assert f'Слов в словаре: {len(WORDS)}' in replies[0]['text']
+
+def test_add_and_delete_word(quiz, cid):
+    within_budget('handle_add_word', quiz.handle_add_word, cid)
+    replies = within_budget('process_add_word', quiz.process_add_word, cid, NEW_WORD[0])
+    assert 'успешно добавлено' in replies[0]['text']
+
+    within_budget('handle_del_word', quiz.handle_del_word, cid)
+    replies = within_budget('process_del_word', quiz.process_del_word, cid, NEW_WORD[0])
+    assert 'успешно удалено' in replies[0]['text']
@@ -0,0 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+
+from log_config import log_event
+
+"""
+Трассировка SQL-запросов на основе событий SQLAlchemy Engine.
+
+В режиме трассировки (TRACE_ENABLED) каждое входящее обновление, обработанное функцией с декоратором
+traced, собирает свои запросы: их число, время, повторы одного и того же запроса с теми же параметрами
+(признак N+1) и превышение бюджета QUERY_BUDGETS. Обновления с повторами, превышением бюджета или
+медленными запросами записываются в журнал событием 'sql_trace'; при TRACE_EXPLAIN для медленных
+SELECT дополнительно сохраняется план (EXPLAIN ANALYZE в PostgreSQL, EXPLAIN QUERY PLAN в SQLite).
+Когда трассировка выключена, traced возвращает исходную функцию, а обработчики событий не подключаются.
+
+query_budget(max_queries) работает независимо от TRACE_ENABLED и предназначен для проверок:
+    with query_budget(3):
+        quiz.handle_next(cid)
+
+Основные функции:
+- register_engine(engine): Запоминает движок БД и при включённой трассировке подключает обработчики событий.
+- traced(name=None): Декоратор обработчика обновления: собирает и анализирует запросы одного вызова.
+- query_budget(max_queries, name): Контекстный менеджер, который выбрасывает QueryBudgetExceeded при превышении числа запросов.
+- trace_stats(): Возвращает по каждому обработчику число вызовов, запросов, повторов и превышений бюджета.
+"""
+
+TRACE_ENABLED = False
+SLOW_QUERY_THRESHOLD = 0.05
+TRACE_EXPLAIN = False
+
+# Допустимое число запросов на одно обновление для обработчиков quiz_config
+QUERY_BUDGETS = {
+    'handle_start': 2,
+    'process_name_input': 5,
+    'handle_response': 4,
+    'handle_add_word': 0,
+    'process_add_word': 6,
+    'handle_del_word': 0,
+    'process_del_word': 4,
+    'handle_next': 3,
+    'handle_stats': 1,
+}
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryTrace:
+    def __init__(self, name, budget=None, handler=False):
+        self.name = name
+        self.budget = budget
+        self.handler = handler
+        # (SQL, параметры, длительность, движок)
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(statement[2] for statement in self.statements)
+
+    # Одинаковые запросы с одинаковыми параметрами, выполненные больше одного раза
+    def repeated(self):
+        seen = {}
+        for statement, parameters, _, _ in self.statements:
+            key = (statement, repr(parameters))
+            seen[key] = seen.get(key, 0) + 1
+        return [(statement, parameters, n) for (statement, parameters), n in seen.items() if n > 1]
+
+    def slow(self):
+        return [item for item in self.statements if item[2] >= SLOW_QUERY_THRESHOLD]
+
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    def describe(self):
+        return '\n'.join(f'  {duration * 1000:.1f} мс: {" ".join(statement.split())}'
+                         for statement, _, duration, _ in self.statements)
+
+_local = threading.local()
+_engines = []
+_installed = set()
+_stats_lock = threading.Lock()
+stats = {}
+
+def _active_traces():
+    traces = getattr(_local, 'traces', None)
+    if traces is None:
+        traces = _local.traces = []
+    return traces
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'traces', None):
+        conn.info['trace_started'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    traces = getattr(_local, 'traces', None)
+    if not traces:
+        return
+
+    started = conn.info.pop('trace_started', None)
+    duration = time.perf_counter() - started if started is not None else 0.0
+    for trace in traces:
+        trace.statements.append((statement, parameters, duration, conn.engine))
+
+def _install(engine):
+    if id(engine) in _installed:
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    _installed.add(id(engine))
+
+def register_engine(engine):
+    _engines.append(engine)
+    if TRACE_ENABLED:
+        _install(engine)
+
+# План медленного SELECT получаем отдельным соединением, вне транзакции обработчика
+def _explain(statement, parameters, engine):
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+
+    prefix = 'EXPLAIN ANALYZE ' if engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    try:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+        return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+    except Exception as e:
+        print(f'Ошибка {e}')
+        return None
+
+def _finish(trace):
+    repeated = trace.repeated()
+    slow = trace.slow()
+
+    with _stats_lock:
+        handler_stats = stats.setdefault(trace.name, {'updates': 0, 'queries': 0, 'max_queries': 0,
+                                                      'repeated': 0, 'over_budget': 0, 'slow': 0})
+        handler_stats['updates'] += 1
+        handler_stats['queries'] += trace.count
+        handler_stats['max_queries'] = max(handler_stats['max_queries'], trace.count)
+        handler_stats['repeated'] += len(repeated)
+        handler_stats['over_budget'] += int(trace.over_budget())
+        handler_stats['slow'] += len(slow)
+
+    if not (repeated or slow or trace.over_budget()):
+        return
+
+    details = {
+        'HANDLER': trace.name,
+        'QUERIES': trace.count,
+        'BUDGET': trace.budget,
+        'DURATION_MS': round(trace.duration * 1000, 3),
+        'REPEATED': [{'SQL': ' '.join(statement.split()), 'TIMES': n} for statement, _, n in repeated],
+        'SLOW': [{'SQL': ' '.join(statement.split()), 'MS': round(duration * 1000, 3)}
+                 for statement, _, duration, _ in slow],
+    }
+    if TRACE_EXPLAIN:
+        details['EXPLAIN'] = [_explain(statement, parameters, engine) for statement, parameters, _, engine in slow]
+
+    log_event('sql_trace', level='warning', **details)
+
+def traced(name=None):
+    def decorator(func):
+        if not TRACE_ENABLED:
+            return func
+
+        trace_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            traces = _active_traces()
+            # Обновление трассируется один раз - самым внешним обработчиком
+            if any(trace.handler for trace in traces):
+                return func(*args, **kwargs)
+
+            trace = QueryTrace(trace_name, QUERY_BUDGETS.get(trace_name), handler=True)
+            traces.append(trace)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                traces.remove(trace)
+                _finish(trace)
+        return wrapper
+    return decorator
+
+@contextmanager
+def query_budget(max_queries, name='query_budget'):
+    for engine in _engines:
+        _install(engine)
+
+    traces = _active_traces()
+    trace = QueryTrace(name, max_queries)
+    traces.append(trace)
+    try:
+        yield trace
+    finally:
+        traces.remove(trace)
+
+    if trace.over_budget():
+        raise QueryBudgetExceeded(f'{name}: {trace.count} запросов при бюджете {max_queries}\n{trace.describe()}')
+
+def trace_stats():
+    with _stats_lock:
+        return {name: dict(values) for name, values in stats.items()}
@@ -0,0 +1,128 @@
+import hmac
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from telebot import types
+
+"""
+Режим webhook: встроенный HTTP-сервер принимает обновления Telegram, проверяет секретный токен,
+сразу отвечает 200 и передаёт обновления в очереди потоков-шардов бота (dispatch_config.ShardedTeleBot):
+обновления одного чата обрабатываются по очереди в порядке поступления.
+Состояние диалога хранится вне процесса (state_config, бэкенд 'postgres'), поэтому несколько
+экземпляров бота можно запускать за балансировщиком нагрузки.
+
+GET {WEBHOOK_PATH}/stats возвращает глубину очередей шардов и задержку обработки в формате JSON.
+
+Основные функции:
+- run_webhook(bot, secret, host, port, url): Запускает приём обновлений через webhook.
+- webhook_stats(): Возвращает счётчики принятых и отклонённых обновлений.
+- make_text_update(update_id, cid, text): Формирует тестовое обновление с текстовым сообщением.
+- feed_updates(endpoint, secret, updates): Отправляет обновления на локальный webhook вместо Telegram.
+"""
+
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/telegram'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+_stats_lock = threading.Lock()
+stats = {
+    'received': 0,
+    'rejected': 0,
+    'invalid': 0,
+}
+
+def webhook_stats():
+    with _stats_lock:
+        return dict(stats)
+
+def _count(name, value=1):
+    with _stats_lock:
+        stats[name] += value
+
+def make_handler(bot, secret):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != WEBHOOK_PATH:
+                return self._respond(404)
+
+            # Telegram передаёт секрет, заданный в setWebhook, в заголовке каждого запроса
+            if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), secret):
+                _count('rejected')
+                return self._respond(403)
+
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+
+            try:
+                update = types.Update.de_json(body.decode('utf-8'))
+            except Exception as e:
+                # Повтор такого обновления ничего не изменит, поэтому отвечаем 200
+                _count('invalid')
+                print(f'Ошибка {e}')
+                return self._respond(200)
+
+            try:
+                bot.submit(update, block=False)
+            except queue.Full:
+                # Telegram повторит доставку позже
+                _count('rejected')
+                return self._respond(503)
+
+            _count('received')
+            self._respond(200)
+
+        def do_GET(self):
+            if self.path != WEBHOOK_PATH + '/stats':
+                return self._respond(404)
+            result = {**webhook_stats(), **bot.dispatch_stats()}
+            self._respond(200, json.dumps(result).encode('utf-8'), 'application/json')
+
+        def _respond(self, code, body=b'', content_type='text/plain'):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Не пишем строку в stderr на каждое обновление
+            pass
+
+    return WebhookHandler
+
+def run_webhook(bot, secret, host=WEBHOOK_HOST, port=WEBHOOK_PORT, url=None):
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url.rstrip('/') + WEBHOOK_PATH, secret_token=secret)
+
+    server = ThreadingHTTPServer((host, port), make_handler(bot, secret))
+    print(f'Webhook is listening on {host}:{port}{WEBHOOK_PATH}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+# Формируем тестовое обновление с текстовым сообщением (для локальной проверки без Telegram)
+def make_text_update(update_id, cid, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': cid, 'type': 'private'},
+            'from': {'id': cid, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        },
+    }
+
+# Заменитель Telegram: отправляем обновления на локальный webhook
+def feed_updates(endpoint, secret, updates):
+    with requests.Session() as http:
+        for update in updates:
+            response = http.post(endpoint, json=update, headers={SECRET_HEADER: secret}, timeout=10)
+            response.raise_for_status()